@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Measures the start-up time of the `tmd` command line tool.
+
+Fails if a listing command takes more than --max-ms to start, or if importing
+the cli pulls in one of the heavy modules.
+
+Usage::
+    python benchmarks/import_time.py [--runs 10] [--max-ms 200]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'tqdm', 'geotiler', 'pyarrow']
+
+
+def start_time_ms(args, runs):
+    timings = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'tmd_tools'] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(1000 * (time.perf_counter() - t))
+    return statistics.median(timings)
+
+
+def heavy_imports():
+    code = 'import sys, tmd_tools.cli; print(" ".join(sys.modules))'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout.decode()
+    modules = set(out.split())
+    return [m for m in HEAVY_MODULES if m in modules]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=200)
+    args = parser.parse_args()
+
+    ok = True
+    heavy = heavy_imports()
+    if heavy:
+        print(f'FAIL: importing tmd_tools.cli imports {", ".join(heavy)}')
+        ok = False
+
+    for command in (['--help'], ['users', '--help'], ['trips', '--help']):
+        ms = start_time_ms(command, args.runs)
+        status = 'ok' if ms <= args.max_ms else 'FAIL'
+        ok = ok and ms <= args.max_ms
+        print(f'{status:4} tmd {" ".join(command):15} {ms:6.1f} ms (median of {args.runs})')
+
+    sys.exit(0 if ok else 1)
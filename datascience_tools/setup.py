@@ -0,0 +1,21 @@
+from setuptools import setup
+
+setup(
+    name='tmd_tools',
+    version='0.1.0',
+    description='Tools to explore and clean the data collected by the tmd data-collection app.',
+    packages=['tmd_tools'],
+    python_requires='>=3.7',
+    install_requires=[
+        'click',
+        'matplotlib',
+        'numpy',
+        'pandas',
+        'tqdm',
+    ],
+    entry_points={
+        'console_scripts': [
+            'tmd = tmd_tools.cli:main',
+        ],
+    },
+)
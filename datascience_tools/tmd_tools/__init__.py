@@ -1,3 +1,11 @@
 from .user_directory import UserDirectory
 from .data_directory import DataDirectory
-from .plot import plot_gps_data
\ No newline at end of file
+from .plot import plot_gps_data
+
+
+def __getattr__(name):
+    # numpy is only imported when the geofences are used, to keep `import tmd_tools` fast.
+    if name in ('GeoFenceIndex', 'filter_trip'):
+        from . import geofences
+        return getattr(geofences, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,104 @@
+from pathlib import Path
+import hashlib
+import json
+import logging
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+def sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BuildManifest:
+    """
+    Records, for each trip processed by a pipeline, the hashes of its input files,
+    the parameters and the code version used, and the output files written.
+
+    Used to only rebuild the trips whose inputs, parameters or code changed,
+    and to delete the outputs which are not produced anymore.
+    Output paths are stored relative to the manifest's directory.
+    """
+    filename = 'manifest.json'
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / BuildManifest.filename
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def save(self):
+        self.root.mkdir(exist_ok=True, parents=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        tmp.replace(self.path)
+
+    def inputs(self, key, paths):
+        """
+        Size, mtime and sha256 of the input files of `key`.
+        Files are only hashed if their size or mtime changed since they were recorded.
+        """
+        previous = self.entries.get(key, {}).get('inputs', {})
+        inputs = {}
+        for path in paths:
+            stat = Path(path).stat()
+            old = previous.get(str(path))
+            if old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+                inputs[str(path)] = old
+            else:
+                inputs[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256(path)}
+        return inputs
+
+    def reason_to_build(self, key, inputs, params, code):
+        """ Why `key` must be rebuilt, or None if its outputs are up to date. """
+        entry = self.entries.get(key)
+        if entry is None:
+            return 'new'
+        if entry['code'] != code:
+            return 'code changed'
+        if entry['params'] != params:
+            return 'parameters changed'
+        hashes = lambda d: {p: i['sha256'] for (p, i) in d.items()}
+        if hashes(entry['inputs']) != hashes(inputs):
+            return 'inputs changed'
+        if not all((self.root / p).exists() for p in entry['outputs']):
+            return 'outputs missing'
+        return None
+
+    def record(self, key, inputs, params, code, outputs, status='built'):
+        """ Records a build of `key`, and deletes its previous outputs that were not written again. """
+        outputs = sorted(str(Path(p).relative_to(self.root)) for p in outputs)
+        old = set(self.entries.get(key, {}).get('outputs', [])) - set(outputs)
+        self._delete(old)
+        self.entries[key] = {
+            'inputs': inputs,
+            'params': params,
+            'code': code,
+            'outputs': outputs,
+            'status': status,
+        }
+
+    def stale(self, keys):
+        """ Recorded keys which are not in keys. """
+        keys = set(keys)
+        return [k for k in self.entries if k not in keys]
+
+    def remove(self, key):
+        """ Deletes the outputs of `key` and forgets it. """
+        self._delete(self.entries.pop(key, {}).get('outputs', []))
+
+    def _delete(self, outputs):
+        for p in outputs:
+            try:
+                (self.root / p).unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import hashlib
+import pickle
+
+from pathlib import Path
+from .data_directory import DataDirectory
+from .query import prefetch_trips
+from .build import BuildManifest, sha256
+from .kinematics import recover_speed
+from .geofences import geofences_path, trip_geofences, filter_trip
+import matplotlib.pyplot as plt
+import gc
+from tqdm.auto import tqdm
+from datetime import timedelta
+
+
+def iter_parts(df, masks_df):
+    """
+    Arguments:
+    df --  the dataframe we want to split into parts
+    masks_df -- a dataframe or dict of boolean masks with same index as df. For instance: `{'<5': df.speed < 5}`
+    """
+    bounds = {}
+    for c in masks_df:
+        mask = masks_df[c]
+        if len(mask.index) != len(df.index) or np.any(mask.index != df.index):
+            #print(f'Reindexing mask for "{c}"')
+            joined_index = np.unique(np.sort(np.concatenate([mask.index, df.index])))
+            mask = mask.reindex(joined_index).ffill().loc[df.index].fillna(False)
+            assert np.all(mask.index == df.index)
+        mask = mask.reset_index(drop=True)
+        b = mask[mask != mask.shift()]
+        bounds[c] = b
+    bounds = pd.DataFrame(bounds).ffill()
+    
+    # to keep track of the index through the splitting process, add it as a column, and record the new column's name
+    idf = df.reset_index()
+    columns_diff = set(idf.columns) - set(df.columns)
+    assert len(columns_diff) == 1
+    index_name = columns_diff.pop()
+    
+    # split into parts
+    parts = np.split(idf.values, bounds.index[1:])
+    assert len(bounds) == len(parts)
+    
+    # the split yields np.array, this utility converts them back to DataFrame with proper columns and index
+    wrap = lambda a: pd.DataFrame(a, columns=idf.columns).set_index(index_name)
+    
+    # yield the parts
+    for (i, row), part in zip(bounds.iterrows(), parts):
+        for c in bounds.columns:
+            if row[c]:
+                yield c, wrap(part)
+                break
+        else: # nobreak
+            yield None, wrap(part)
+
+
+def filter_groups(mask, min_length):
+    """
+    Drops groups of consecutive True values in mask whose length are less than min_length.
+    
+    Parameters:
+    mask -- a boolean mask (a series of True/False values)
+    min_length -- integer: drop True values if less than min_length consecutive true values
+    """
+    sm = pd.DataFrame(mask, columns=[mask.name], index=mask.index)
+    sm['group'] = (mask != mask.shift()).cumsum()
+    sm2 = sm.groupby('group').filter(lambda g: len(g) > min_length)
+    sm2 = sm2.reindex(sm.index).fillna(False)
+    mask = sm2[mask.name]
+    return mask
+
+
+def get_data(trip, dfs=None):
+    dfs = dfs or {}
+    adf = dfs['accelerometer'] if 'accelerometer' in dfs else trip.data['accelerometer'].df
+    #adf.index = pd.to_datetime(adf.index, unit='ms')
+    adf.dropna(inplace=True)
+    adf = adf.groupby(adf.index).first()
+    adf['norm'] = adf[['x', 'y', 'z']].apply(np.linalg.norm, axis=1)
+    
+    if 'gps' not in trip.data:
+        gdf = None
+    else:
+        gdf = dfs['gps'] if 'gps' in dfs else trip.data['gps'].df
+        gdf = gdf[(adf.first_valid_index() <= gdf.index) & (gdf.index <= adf.last_valid_index())]
+        #gdf.index = pd.to_datetime(gdf.index, unit='ms')
+        # only the fixes without position are dropped: missing speeds can be derived, see write_trip
+        gdf = gdf[gdf.index.notna()].dropna(subset=['latitude', 'longitude'])
+        gdf = gdf.groupby(gdf.index).first()
+
+    return adf, gdf
+
+
+def plot_trip(title, adf, speed, masks):
+    fig, ax = plt.subplots(nrows=5, ncols=1, figsize=(20, 5), sharex=True)
+    fig.suptitle(title)
+    for label, part in iter_parts(adf, masks):
+        color = label or 'C0'
+        part.x.plot(ax=ax[0], color=color)
+        part.y.plot(ax=ax[1], color=color)
+        part.z.plot(ax=ax[2], color=color)
+        part.norm.plot(ax=ax[3], color=color)
+
+    last = None
+    last_color = None
+    for label, part in iter_parts(pd.DataFrame(speed), masks):#gdf[['speed']], masks):
+        #part.speed.plot(ax=ax[-1], color=label or 'C0')
+        ax[-1].plot(part.speed.index, part.speed.values, color=label or 'C0')
+        if last is not None and (label == 'black' or last_color == 'black'):
+            plt.plot([last.name, part.iloc[0].name], [last.values[0], part.iloc[0].values[0]], color='black', alpha=0.3)
+        last = part.iloc[-1]
+        last_color = label or 'C0'
+    return fig
+
+
+def fig_title(trip):
+    title = str(trip.data['accelerometer'].filepath)
+    title = title[title.rfind('/', 0, title.rfind('/'))+1:title.rfind('_', 0, title.rfind('_'))]
+    return title
+
+
+# Parameters of `write_trip`, recorded in the build manifest with the outputs of each trip.
+PARAMETERS = {
+    'speed_resampling': '1s',
+    'endpoint_minutes': 1,       # data removed at the start and the end of the trip
+    'still_speed': 0.02,         # m/s, below which the user is still
+    'still_min_length': 30,      # samples of speed, see filter_groups
+    'threshold_min_length': 2,   # samples of speed, see filter_groups
+    'derive_speed': True,        # fill missing gps speed from the positions, see kinematics.py
+    'smoothing_window': 5,       # fixes, positions are averaged over, see kinematics.smooth
+    'max_speed': 70,             # m/s, jumps between fixes faster than this are outliers
+    'max_accuracy': None,        # m, fixes less accurate than this are dropped, None to keep them
+    'min_distance': 1,           # m, heading is not derived for smaller moves
+}
+
+
+def trip_params(trip):
+    return dict(PARAMETERS, speed_threshold=speed_threshold_for(trip.mode))
+
+
+# Modules whose code determines the outputs of `write_trip`, relative to this file.
+CODE_FILES = [
+    'clean_data.py',
+    'trip_data.py',
+    'trip.py',
+    'utils.py',
+    'geo.py',
+    'geofences.py',
+    'kinematics.py',
+]
+
+
+def code_version():
+    """ Hash of the pipeline's modules, outputs are rebuilt when the pipeline's code changes. """
+    here = Path(__file__).parent
+    h = hashlib.sha256()
+    for f in CODE_FILES:
+        h.update(sha256(here / f).encode())
+    return h.hexdigest()
+
+
+def trip_key(trip):
+    fp = trip.data['accelerometer'].filepath
+    return str(fp.relative_to(fp.parent.parent))
+
+
+def input_paths(trip):
+    paths = [trip.data[s].filepath for s in ('accelerometer', 'gps') if s in trip.data]
+    geofences = geofences_path(trip)
+    return paths + [geofences] if geofences.exists() else paths
+
+
+def speed_threshold_for(mode):
+    if mode in ['walk', 'walking']:
+        return 0.5
+    elif mode in ['bike', 'biking', 'cycling']:
+        return 1
+    else:
+        return 2
+
+
+def fig_output_filename(trip, plot_dir, ext='.svg'):
+    fp = trip.data['accelerometer'].filepath
+    title = f'{fp.relative_to(fp.parent.parent)}'
+    path = (plot_dir / trip.mode / title.replace('/', '_')).with_suffix(ext)
+    return path
+
+
+def write_fig(trip, adf, speed, color_masks, plot_dir):
+    fig = plot_trip(fig_title(trip), adf, speed, color_masks)
+    path = fig_output_filename(trip, plot_dir, ext='.png')
+    path.parent.mkdir(exist_ok=True, parents=True)
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def write_segments(trip, adf, mode_masks, output_dir):
+    fstem = trip.data['accelerometer'].filepath.stem
+    paths = []
+    for i, (label, part) in enumerate(iter_parts(adf, mode_masks)):
+        part = part.reset_index()
+        part['ms'] = part['ms'].values.astype(np.int64) // (10**6)
+        part = part[['ms', 'x', 'y', 'z']]
+        #
+        label = label or trip.mode
+        output_path = output_dir / label / f'{fstem}-{i:03}.zip'
+        output_path.parent.mkdir(exist_ok=True, parents=True)
+        #
+        part.to_csv(output_path, index=False)
+        paths.append(output_path)
+    return paths
+
+
+def to_ms(minutes):
+    return 60*1000*minutes
+
+
+def record_skipped_trip(trip, no_gps_trips_file, reason='No GPS data'):
+    fp = trip.data['accelerometer'].filepath
+    fp = fp.relative_to(fp.parent.parent)
+    with open(no_gps_trips_file, 'a') as f:
+        f.write(f'{fp}\n')
+    tqdm.write(f'{reason} for {str(fp)}')
+
+
+def write_trip(trip, plot_dir, output_dir, no_gps_trips_file, dfs=None):
+    """
+    Writes the segments and the plot of trip.
+    Returns the list of written paths and a status: 'built' or 'skipped: <reason>'.
+    """
+    if 'gps' not in trip.data:
+        record_skipped_trip(trip, no_gps_trips_file)
+        return [], 'skipped: No GPS data'
+    if dfs and dfs['accelerometer'].empty:
+        record_skipped_trip(trip, no_gps_trips_file, 'No data outside the geofences')
+        return [], 'skipped: No data outside the geofences'
+
+    params = trip_params(trip)
+    adf, gdf = get_data(trip, dfs)
+    if params['derive_speed']:
+        gdf = recover_speed(
+            gdf,
+            smoothing_window=params['smoothing_window'],
+            max_speed=params['max_speed'],
+            max_accuracy=params['max_accuracy'],
+            min_distance=params['min_distance'])
+    gdf = gdf.dropna(subset=['speed'])
+    speed = gdf.speed[gdf.speed.first_valid_index(): gdf.speed.last_valid_index()]
+    if np.all(speed.fillna(-1) < 0):
+        record_skipped_trip(trip, no_gps_trips_file, 'No speed data')
+        return [], 'skipped: No speed data'
+
+    speed = gdf.speed.resample(params['speed_resampling']).first().fillna(-1)
+    thr = params['speed_threshold']
+
+    trim = timedelta(minutes=params['endpoint_minutes'])
+    remove_endpoints = ( adf.index < adf.first_valid_index() + trim) | (adf.last_valid_index() - trim < adf.index)
+    remove_endpoints = pd.Series(remove_endpoints, index=adf.index)
+    still_mask = filter_groups(mask=(np.abs(speed) < params['still_speed']), min_length=params['still_min_length'])
+    threshold_mask = filter_groups(mask=(speed < thr), min_length=params['threshold_min_length'])
+    color_masks = {'red': remove_endpoints, 'C1': still_mask, 'black': threshold_mask,}
+    mode_masks = {'endpoints': remove_endpoints, 'still': still_mask, 'null': threshold_mask,}
+
+    outputs = write_segments(trip, adf, mode_masks, output_dir)
+    try:
+        outputs.append(write_fig(trip, adf, speed, color_masks, plot_dir))
+    except Exception as e:
+        print('During plot function:', fig_output_filename(trip, plot_dir), e)
+    return outputs, 'built'
+
+
+def get_data_trips(data_dir, min_minutes=5):
+    return data_dir.query().min_duration(minutes=min_minutes)
+
+
+def load_sensors(trip):
+    """
+    Loads the dataframes used by `write_trip`, without the data recorded inside
+    the user's geofences. Runs in the prefetching threads.
+    Exceptions are returned rather than raised, so that they are handled with the trip.
+    """
+    if 'gps' not in trip.data:
+        return {}
+    try:
+        return filter_trip(trip, trip_geofences(trip), sensors=('accelerometer', 'gps'))
+    except Exception as e:
+        return e
+
+
+def build_plan(trips, manifest, rejected=()):
+    """
+    Trips to rebuild, as a dict {key: (trip, inputs, params, reason)}, and the stale keys of the manifest.
+    The outputs of the rejected trips, see `TripQuery.quality`, are kept.
+    """
+    code = code_version()
+    plan = {}
+    keys = []
+    for trip in trips:
+        key = trip_key(trip)
+        keys.append(key)
+        inputs = manifest.inputs(key, input_paths(trip))
+        params = trip_params(trip)
+        reason = manifest.reason_to_build(key, inputs, params, code)
+        if reason:
+            plan[key] = (trip, inputs, params, reason)
+    return plan, manifest.stale(keys + [trip_key(t) for (t, _) in rejected])
+
+
+def print_plan(plan, stale, rejected=(), verbose=False):
+    print(f'{len(rejected):5} trips dropped by their quality profile')
+    if verbose:
+        for (trip, reason) in rejected:
+            print(f'        {trip_key(trip)}: {reason}')
+    reasons = {}
+    for (key, (_, _, _, reason)) in plan.items():
+        reasons.setdefault(reason, []).append(key)
+    for (reason, keys) in sorted(reasons.items()):
+        print(f'{len(keys):5} trips to rebuild: {reason}')
+        if verbose:
+            for k in keys:
+                print(f'        {k}')
+    print(f'{len(stale):5} stale trips to remove')
+    if verbose:
+        for k in stale:
+            print(f'        {k}')
+
+
+def clean(input_dir, output_dir, dry_run=False):
+    datadir = Path(input_dir)  # '/home/julien/data_collection_app/server/app/data'
+    output_dir  = Path(output_dir)  # './data-v3'
+    
+    data_dir = DataDirectory(datadir)
+    manifest = BuildManifest(output_dir)
+    rejected = []
+    trips = list(get_data_trips(data_dir).quality(rejected=rejected, sensors=('accelerometer', 'gps')))
+    plan, stale = build_plan(trips, manifest, rejected)
+    print_plan(plan, stale, rejected, verbose=dry_run)
+    if dry_run:
+        return
+
+    for key in stale:
+        manifest.remove(key)
+    manifest.save()
+
+    plot_dir = plot_dir = output_dir / 'plots'
+    output_dir = output_dir / 'data'
+    output_dir.mkdir(exist_ok=True, parents=True)
+    no_gps_trips_file = output_dir / 'to_handle.txt'
+    errors_path = output_dir / 'errors.pkl'
+
+    errors = []
+
+    try:
+        with open(errors_path, 'rb') as f:
+            errors = pickle.load(f)
+            print(f'Errors list of length {len(errors)} loaded from previous run')
+    except:
+        print('Unable to load errors from previous run, starting with empty list')
+        pass
+
+    code = code_version()
+    trips = [trip for (trip, _, _, _) in plan.values()]
+    trips = tqdm(prefetch_trips(trips, load=load_sensors), miniters=1, total=len(trips))
+    try:
+        for (i, (trip, dfs)) in enumerate(trips):
+            try:
+                trips.set_description(fig_title(trip))
+                if isinstance(dfs, Exception):
+                    raise dfs
+                outputs, status = write_trip(trip, plot_dir, output_dir, no_gps_trips_file, dfs)
+                key = trip_key(trip)
+                _, inputs, params, _ = plan[key]
+                manifest.record(key, inputs, params, code, outputs, status)
+                if i % 50 == 0:
+                    manifest.save()
+                gc.collect()
+            except Exception as e:
+                error_data = (f'{type(e)} - {e}', str(trip.data['accelerometer'].filepath))
+                tqdm.write(f'{error_data}')
+                errors.append(error_data)
+                if not isinstance(e, UnicodeDecodeError):
+                    raise
+    finally:
+        manifest.save()
+        with open(errors_path, 'wb') as f:
+            pickle.dump(errors, f)
+
+
+if __name__=='__main__':
+    import click
+
+    @click.command()
+    @click.argument('input_dir')
+    @click.argument('output_dir')
+    @click.option('--dry-run', is_flag=True, help='Only print the trips that would be rebuilt.')
+    def main(input_dir, output_dir, dry_run):
+        clean(input_dir, output_dir, dry_run)
+
+    main()
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+The `tmd` command line tool.
+
+Heavy modules (pandas, numpy, matplotlib) are imported inside the subcommands
+that need them, so that listing commands start quickly. See
+`benchmarks/import_time.py`.
+"""
+from pathlib import Path
+import click
+
+
+@click.group()
+def main():
+    """ Tools for the transportation mode detection data. """
+
+
+def _data_dir(path):
+    from .data_directory import DataDirectory
+    return DataDirectory(Path(path))
+
+
+@main.command()
+@click.argument('data_dir')
+@click.option('--all', 'all_users', is_flag=True, help='Include emulators and users without data.')
+def users(data_dir, all_users):
+    """ List the users of DATA_DIR. """
+    data_dir = _data_dir(data_dir)
+    users = data_dir.users if all_users else data_dir.physical_users
+    for user in users:
+        n_trips = len(user.trips) if user.exists else 0
+        click.echo(f'{user.uid}  {user.user_name:20}  {n_trips:4} trips')
+
+
+@main.command()
+@click.argument('data_dir')
+@click.option('--user', 'uids', multiple=True, help='Uid (or uid prefix) of the users to list.')
+@click.option('--mode', 'modes', multiple=True, help='Modes to list.')
+@click.option('--min-minutes', default=0, help='Minimum duration of the trips.')
+def trips(data_dir, uids, modes, min_minutes):
+    """ List the trips of DATA_DIR. """
+    query = _data_dir(data_dir).query().min_duration(minutes=min_minutes)
+    if uids:
+        query = query.users(*uids)
+    if modes:
+        query = query.mode(*modes)
+    for trip in query:
+        click.echo(f'{trip}  {", ".join(sorted(trip.data))}')
+
+
+@main.command()
+@click.argument('data_dir')
+def durations(data_dir):
+    """ Print the total duration recorded for each mode. """
+    _data_dir(data_dir).print_durations()
+
+
+@main.command()
+@click.argument('input_dir')
+@click.argument('output_dir')
+@click.option('--dry-run', is_flag=True, help='Only print the trips that would be rebuilt.')
+def clean(input_dir, output_dir, dry_run):
+    """ Clean the trips of INPUT_DIR into segments and plots in OUTPUT_DIR. """
+    from . import clean_data
+    clean_data.clean(input_dir, output_dir, dry_run)
+
+
+@main.command()
+@click.argument('data_dir')
+@click.option('--workers', default=None, type=int, help='Number of processes, defaults to the number of cpus.')
+@click.option('--overwrite', is_flag=True, help='Recompute existing profiles.')
+def profile(data_dir, workers, overwrite):
+    """ Compute the quality profiles of the files of DATA_DIR. """
+    from tqdm.auto import tqdm
+    from .quality import profile_data_directory
+    n_errors = 0
+    for (trip_data, p) in tqdm(profile_data_directory(_data_dir(data_dir), workers, overwrite)):
+        n_errors += 'error' in p
+    click.echo(f'{n_errors} unreadable files')
+
+
+@main.command()
+@click.argument('clean_dir')
+@click.argument('dataset_dir')
+@click.option('--shard-mb', default=256, help='Size of the shards, in MB.')
+def dataset(clean_dir, dataset_dir, shard_mb):
+    """ Write the segments of CLEAN_DIR as memory-mappable shards in DATASET_DIR. """
+    from tqdm.auto import tqdm
+    from .training_dataset import build_dataset
+    for path in tqdm(build_dataset(clean_dir, dataset_dir, shard_mb * 2**20), miniters=1):
+        pass
+
+
+@main.command()
+@click.argument('filepath')
+@click.option('-o', '--output', default=None, help='Save the figure instead of showing it.')
+def plot(filepath, output):
+    """ Plot the data of one sensor file. """
+    import matplotlib.pyplot as plt
+    from .trip_data import TripData
+    from . import utils
+    data = TripData.parse(filepath)
+    if data is None:
+        raise click.BadParameter(f'unable to parse filename: {filepath}')
+    if data.sensor == 'gps':
+        from .plot import plot_gps_data
+        fig, ax = plt.subplots(figsize=(10, 10))
+        plot_gps_data(ax, data.df, simplify=5)
+    else:
+        fig, _ = utils.plot_timeseries(data.df)
+    fig.suptitle(str(data))
+    if output:
+        fig.savefig(output)
+    else:
+        plt.show()
+
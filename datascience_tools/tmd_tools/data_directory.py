@@ -1,23 +1,48 @@
 from pathlib import Path
 import json
 import datetime
-import pandas as pd
 from . import user_directory as ud
+from . import query as q
 
 class DataDirectory:
     uids_filename = 'uids.json'
+    placement_filename = 'placement.json'
         
-    def __init__(self, path):
+    def __init__(self, path, roots=None):
+        """
+        Arguments:
+        path -- the server's primary data directory, holding uids.json
+        roots -- dict {server path: local path} for the data roots of the server,
+                 when they are mounted elsewhere locally
+        """
         self.path = Path(path)
-        self.uids = json.load(open(path/DataDirectory.uids_filename))
+        self.uids = json.load(open(self.path/DataDirectory.uids_filename))
+        self.roots = {str(k): Path(v) for (k, v) in (roots or {}).items()}
+        try:
+            self.placement = json.load(open(self.path/DataDirectory.placement_filename))
+        except FileNotFoundError:
+            self.placement = {}
+
+    def user_root(self, uid):
+        """
+        Data root holding the directory of uid, as recorded in the server's placement map.
+        Defaults to self.path, e.g. for mirrored copies where all the users are in one directory.
+        """
+        root = self.placement.get(uid)
+        if root is not None:
+            root = self.roots.get(root, Path(root))
+            if (root / uid).is_dir():
+                return root
+        return self.path
         
     @property
     def uids_df(self):
-        return pd.DataFrame(d.uids).transpose()
+        import pandas as pd
+        return pd.DataFrame(self.uids).transpose()
 
     @property
     def users(self):
-        return [ud.UserDirectory(self.path, uid, data) for (uid, data) in self.uids.items()]
+        return [ud.UserDirectory(self.user_root(uid), uid, data) for (uid, data) in self.uids.items()]
     
     @property
     def existing_users(self):
@@ -27,6 +52,10 @@ class DataDirectory:
     def physical_users(self):
         return [u for u in self.existing_users if u.data.get('physical', True)]
 
+    def query(self):
+        """ Lazy query over the trips of the physical users, see TripQuery. """
+        return q.TripQuery(self)
+
     @property 
     def durations(self):
         d = {}
@@ -52,10 +81,10 @@ class DataDirectory:
         print(f'{"total":9} {total_hours:.1f}h')
 
     def get_by_uid(self, uid):
-        return [ud.UserDirectory(self.path, u, data) for (u, data) in self.uids.items() if u.startswith(uid)]
+        return [ud.UserDirectory(self.user_root(u), u, data) for (u, data) in self.uids.items() if u.startswith(uid)]
 
     def __getitem__(self, uid):
-        return ud.UserDirectory(self.path, uid, self.uids[uid])
+        return ud.UserDirectory(self.user_root(uid), uid, self.uids[uid])
 
     def __repr__(self):
         if self.path.is_dir():
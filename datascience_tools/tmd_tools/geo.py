@@ -0,0 +1,15 @@
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean earth radius, in meters
+METERS_PER_DEGREE = 2 * np.pi * EARTH_RADIUS / 360
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in meters between (lat1, lon1) and (lat2, lon2).
+
+    Arguments are in degrees and can be scalars or numpy arrays (broadcasted).
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
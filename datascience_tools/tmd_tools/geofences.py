@@ -0,0 +1,267 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+import json
+import logging
+import shutil
+import numpy as np
+from .geo import haversine, METERS_PER_DEGREE
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+@dataclass
+class GeoFence:
+    latitude: float        # in degrees
+    longitude: float       # in degrees
+    radiusInMeters: float
+
+
+def _wrap_longitude(longitude):
+    return (np.asarray(longitude, dtype=float) + 180) % 360 - 180
+
+
+def _longitude_ranges(lo, hi):
+    """ The longitudes from lo to hi, as ranges within [-180, 180]. """
+    if hi - lo >= 360:
+        return [(-180, 180)]
+    lo, hi = float(_wrap_longitude(lo)), float(_wrap_longitude(hi))
+    if lo <= hi:
+        return [(lo, hi)]
+    return [(lo, 180), (-180, hi)]
+
+
+class GeoFenceIndex:
+    """
+    Grid index over a user's private geofences.
+
+    Each fence is registered in every grid cell overlapped by its bounding box,
+    so a GPS fix is only compared with the fences of its own cell. Longitudes
+    are wrapped to [-180, 180), so fences across the antimeridian are matched.
+    """
+    filename = 'geofences.json'
+
+    def __init__(self, fences, cell_size=0.01):
+        """
+        Arguments:
+        fences -- iterable of GeoFence
+        cell_size -- size of a grid cell, in degrees
+        """
+        self.fences = list(fences)
+        self.cell_size = cell_size
+        self._lat = np.array([f.latitude for f in self.fences], dtype=float)
+        self._lon = np.array([f.longitude for f in self.fences], dtype=float)
+        self._radius = np.array([f.radiusInMeters for f in self.fences], dtype=float)
+
+        keys, ids = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for i, f in enumerate(self.fences):
+            dlat = f.radiusInMeters / METERS_PER_DEGREE
+            dlon = dlat / max(np.cos(np.radians(f.latitude)), 1e-6)
+            ys = np.arange(self._cell(f.latitude - dlat), self._cell(f.latitude + dlat) + 1)
+            xs = np.unique(np.concatenate([
+                np.arange(self._cell(lo), self._cell(hi) + 1)
+                for (lo, hi) in _longitude_ranges(f.longitude - dlon, f.longitude + dlon)]))
+            ys, xs = np.meshgrid(ys, xs)
+            keys.append(self._key(ys.ravel(), xs.ravel()))
+            ids.append(np.full(ys.size, i, dtype=np.int64))
+        keys, ids = np.concatenate(keys), np.concatenate(ids)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._ids = ids[order]
+
+    @staticmethod
+    def load(path):
+        """ Loads the index from a `geofences.json` file, as uploaded by the app. """
+        with open(path) as f:
+            data = json.load(f)
+        return GeoFenceIndex([GeoFence(d['latitude'], d['longitude'], d['radiusInMeters']) for d in data])
+
+    def _cell(self, degrees):
+        return np.floor(np.asarray(degrees, dtype=float) / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def _key(y, x):
+        return (np.asarray(y, dtype=np.int64) << 32) + np.asarray(x, dtype=np.int64)
+
+    def contains(self, latitudes, longitudes):
+        """
+        Returns a boolean array, True for the fixes that lie inside any fence.
+
+        Fixes are matched against candidate fences of their cell in a single
+        vectorized pass: (fix, fence) candidate pairs are expanded with
+        np.repeat and checked with one haversine call.
+        """
+        lat = np.asarray(latitudes, dtype=float)
+        lon = np.asarray(longitudes, dtype=float)
+        inside = np.zeros(lat.shape, dtype=bool)
+        if not self.fences:
+            return inside
+        points = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        keys = self._key(self._cell(lat[points]), self._cell(_wrap_longitude(lon[points])))
+        lo = np.searchsorted(self._keys, keys, side='left')
+        hi = np.searchsorted(self._keys, keys, side='right')
+        counts = hi - lo
+        if not counts.any():
+            return inside
+        point_idx = np.repeat(points, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        fence_idx = self._ids[np.repeat(lo, counts) + offsets]
+        d = haversine(lat[point_idx], lon[point_idx], self._lat[fence_idx], self._lon[fence_idx])
+        inside[point_idx[d <= self._radius[fence_idx]]] = True
+        return inside
+
+    def __len__(self):
+        return len(self.fences)
+
+    def __repr__(self):
+        return f'GeoFenceIndex({len(self.fences)} fences)'
+
+
+_MIN_TIME = np.datetime64(np.iinfo(np.int64).min + 1, 'ns')
+_MAX_TIME = np.datetime64(np.iinfo(np.int64).max, 'ns')
+
+
+def masked_spans(index, mask, margin=timedelta(0)):
+    """
+    Returns the (starts, ends) time spans of consecutive True values in mask.
+
+    Each span extends to the neighbouring False timestamps, since the position
+    is unknown between two fixes, and to the start (or end) of time when it
+    touches the first (or last) fix.
+
+    Arguments:
+    index -- a DatetimeIndex, sorted
+    mask -- boolean mask with same length as index
+    margin -- timedelta added on both sides of each span
+    """
+    mask = np.asarray(mask, dtype=bool)
+    times = np.asarray(index.values, dtype='datetime64[ns]')
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1) - 1
+    margin = np.timedelta64(margin)
+    starts = np.where(first > 0, times[np.maximum(first - 1, 0)] - margin, _MIN_TIME)
+    ends = np.where(last < len(times) - 1, times[np.minimum(last + 1, len(times) - 1)] + margin, _MAX_TIME)
+    return starts.astype('datetime64[ns]'), ends.astype('datetime64[ns]')
+
+
+def in_spans(index, starts, ends):
+    """ Returns a boolean array, True for the timestamps of index within one of the spans. """
+    t = np.asarray(index.values)
+    i = np.searchsorted(starts, t, side='right') - 1
+    inside = i >= 0
+    inside[inside] = t[inside] <= ends[i[inside]]
+    return inside
+
+
+def apply_mask(df, mask, drop=True):
+    """ Drops the rows of df where mask is True, or sets them to NaN if drop is False. """
+    if drop:
+        return df[~mask]
+    df = df.copy()
+    df.loc[mask] = np.nan
+    return df
+
+
+def geofences_path(trip):
+    """ Path of the geofences of the user who recorded trip. """
+    return next(iter(trip.data.values())).filepath.parent / GeoFenceIndex.filename
+
+
+@lru_cache(maxsize=64)
+def _load_index(path, mtime):
+    return GeoFenceIndex.load(path)
+
+
+def trip_geofences(trip):
+    """ The GeoFenceIndex of the user who recorded trip, or None if they uploaded no geofences. """
+    path = geofences_path(trip)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_index(path, mtime)
+
+
+def filter_trip(trip, index, drop=True, margin=timedelta(0), sensors=None):
+    """
+    Loads the sensor data of the trip, without what was recorded inside the geofences.
+
+    GPS fixes are matched against the fences, the other sensors are filtered
+    on the time spans during which the GPS was inside a fence, see `masked_spans`.
+    Fixes without a position are dropped when they are within such a span.
+
+    Returns a dict {sensor: dataframe}, of the given sensors or of all the sensors of the trip.
+    """
+    sensors = sensors or list(trip.data)
+    dfs = {sensor: trip.data[sensor].df for sensor in sensors if sensor in trip.data}
+    if index and 'gps' not in dfs and 'gps' in trip.data:
+        # the spans inside the fences are always computed from the gps
+        dfs['gps'] = trip.data['gps'].df
+    if not index or 'gps' not in dfs:
+        return dfs
+    gdf = dfs['gps'] = dfs['gps'].sort_index(kind='mergesort')
+    inside = index.contains(gdf.latitude.values, gdf.longitude.values)
+    if not inside.any():
+        return dfs
+    located = (gdf.latitude.notna() & gdf.longitude.notna()).values
+    starts, ends = masked_spans(gdf.index[located], inside[located], margin)
+    for (sensor, df) in dfs.items():
+        if sensor == 'gps':
+            m = inside | (~located & in_spans(df.index, starts, ends))
+        else:
+            m = in_spans(df.index, starts, ends)
+        dfs[sensor] = apply_mask(df, m, drop)
+    return dfs
+
+
+def write_csv(df, path):
+    """ Writes df back in the format of the files uploaded by the app. """
+    df = df.drop(columns='norm', errors='ignore')
+    df.index = df.index.values.astype('datetime64[ms]').astype(np.int64)
+    df.to_csv(path, header=False)
+
+
+def filter_data_directory(data_dir, output_dir, drop=True, margin=timedelta(0)):
+    """
+    Writes a copy of data_dir into output_dir, without the data recorded inside the geofences.
+
+    Users without geofences are copied as is. Yields the trips as they are processed.
+    """
+    from .data_directory import DataDirectory
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    shutil.copy(data_dir.path / DataDirectory.uids_filename, output_dir)
+    for user in data_dir.existing_users:
+        index = user.geofences
+        user_dir = output_dir / user.uid
+        user_dir.mkdir(exist_ok=True)
+        for trip in user.trips:
+            if index:
+                for (sensor, df) in filter_trip(trip, index, drop, margin).items():
+                    write_csv(df, user_dir / trip.data[sensor].filepath.name)
+            else:
+                for data in trip.data.values():
+                    shutil.copy(data.filepath, user_dir)
+            yield trip
+
+
+if __name__=='__main__':
+    import click
+    from tqdm.auto import tqdm
+    from .data_directory import DataDirectory
+
+    @click.command()
+    @click.argument('input_dir')
+    @click.argument('output_dir')
+    @click.option('--mask', is_flag=True, help='Replace data inside geofences with NaN instead of dropping it.')
+    @click.option('--margin', default=0, help='Seconds removed around each span spent inside a fence.')
+    def main(input_dir, output_dir, mask, margin):
+        data_dir = DataDirectory(Path(input_dir))
+        trips = filter_data_directory(data_dir, output_dir, drop=not mask, margin=timedelta(seconds=margin))
+        for trip in tqdm(trips, miniters=1):
+            pass
+
+    main()
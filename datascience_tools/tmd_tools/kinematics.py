@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from .geo import haversine, EARTH_RADIUS
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """ Initial bearing from (lat1, lon1) to (lat2, lon2), in degrees clockwise from north, in [0, 360). """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def to_local_xy(latitudes, longitudes):
+    """ Equirectangular projection in meters around the mean position, precise enough for a trip. """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    lat0 = np.nanmean(lat)
+    return EARTH_RADIUS * (lon - np.nanmean(lon)) * np.cos(lat0), EARTH_RADIUS * (lat - lat0)
+
+
+def _seconds(index):
+    return np.asarray(index.values, dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+
+def _steps(lat, lon, t):
+    """ Distance (m), duration (s) and speed (m/s) between consecutive fixes. """
+    d = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    dt = np.diff(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(dt > 0, d / dt, np.where(d > 0, np.inf, 0))
+    return d, dt, v
+
+
+def reject_outliers(gdf, max_speed=70, max_accuracy=None):
+    """
+    Drops the fixes that are unreachable from both of their neighbours (spikes),
+    and the fixes whose accuracy is worse than max_accuracy (m).
+
+    Arguments:
+    gdf -- gps dataframe, indexed by time, with latitude, longitude and accuracy columns
+    max_speed -- in m/s, speed above which a jump between two fixes is not physical
+    """
+    lat, lon = gdf.latitude.values, gdf.longitude.values
+    if len(gdf) < 3:
+        return gdf
+    _, _, v = _steps(lat, lon, _seconds(gdf.index))
+    v_in = np.concatenate([[0], v])
+    v_out = np.concatenate([v, [0]])
+    bad = (v_in > max_speed) & (v_out > max_speed)
+    if max_accuracy is not None and 'accuracy' in gdf:
+        bad |= gdf.accuracy.values > max_accuracy
+    return gdf[~bad]
+
+
+def smooth(gdf, window=5):
+    """
+    Accuracy-weighted moving average of the positions over `window` fixes.
+    Each fix is weighted by 1/accuracy², fixes without accuracy get the median weight.
+    """
+    if window <= 1 or len(gdf) < 2:
+        return gdf
+    accuracy = gdf.accuracy.values.astype(float) if 'accuracy' in gdf else np.ones(len(gdf))
+    w = 1 / np.maximum(accuracy, 1)**2
+    w = np.where(np.isfinite(w), w, np.nanmedian(w) if np.isfinite(w).any() else 1)
+    kernel = np.ones(window)
+    den = np.convolve(w, kernel, mode='same')
+    gdf = gdf.copy()
+    for c in ('latitude', 'longitude'):
+        gdf[c] = np.convolve(w * gdf[c].values, kernel, mode='same') / den
+    return gdf
+
+
+def kinematics(gdf, smoothing_window=5, max_speed=70, max_accuracy=None, min_distance=1):
+    """
+    Speed, acceleration and heading derived from consecutive GPS fixes.
+
+    Outliers are dropped and positions smoothed first, see `reject_outliers` and `smooth`.
+    Returns a dataframe with the same index as the remaining fixes and the columns
+    latitude, longitude (smoothed), distance (m, from the previous fix),
+    derived_speed (m/s), derived_acceleration (m/s²) and derived_heading (degrees,
+    NaN when moving less than min_distance meters).
+    """
+    gdf = gdf[gdf.latitude.notna() & gdf.longitude.notna()]
+    gdf = smooth(reject_outliers(gdf, max_speed, max_accuracy), smoothing_window)
+    lat, lon = gdf.latitude.values, gdf.longitude.values
+    t = _seconds(gdf.index)
+    df = pd.DataFrame({'latitude': lat, 'longitude': lon}, index=gdf.index)
+    if len(gdf) < 2:
+        for c in ('distance', 'derived_speed', 'derived_acceleration', 'derived_heading'):
+            df[c] = np.nan
+        return df
+    d, dt, v = _steps(lat, lon, t)
+    v = np.where(np.isfinite(v), v, np.nan)
+    speed = np.concatenate([v[:1], v])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        acceleration = np.concatenate([[0], np.where(dt > 0, np.diff(speed) / dt, np.nan)])
+    heading = bearing(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    heading = np.where(d >= min_distance, heading, np.nan)
+    df['distance'] = np.concatenate([[0], d])
+    df['derived_speed'] = speed
+    df['derived_acceleration'] = acceleration
+    df['derived_heading'] = np.concatenate([heading[:1], heading])
+    return df
+
+
+def recover_speed(gdf, **kwargs):
+    """
+    Fills the speed and heading reported by the device, when missing (NaN or negative),
+    with the values derived from the positions. See `kinematics` for the arguments.
+    """
+    k = kinematics(gdf, **kwargs)
+    gdf = gdf.copy()
+    for (column, derived) in (('speed', 'derived_speed'), ('heading', 'derived_heading')):
+        if column not in gdf:
+            continue
+        derived = k[derived].reindex(gdf.index)
+        missing = gdf[column].isna() | (gdf[column] < 0)
+        gdf[column] = gdf[column].where(~missing, derived)
+    return gdf
+
+
+def douglas_peucker(latitudes, longitudes, tolerance=5):
+    """
+    Douglas-Peucker simplification of a track.
+
+    Returns a boolean mask of the fixes to keep so that the track does not move
+    by more than `tolerance` meters. The distances to each chord are computed in
+    one array operation per split.
+    """
+    x, y = to_local_xy(latitudes, longitudes)
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        px, py = x[i+1:j] - x[i], y[i+1:j] - y[i]
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        norm = np.hypot(dx, dy)
+        if norm > 0:
+            d = np.abs(dy * px - dx * py) / norm
+        else:
+            d = np.hypot(px, py)
+        k = np.argmax(d)
+        if d[k] > tolerance:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return keep
+
+
+def simplify(gdf, tolerance=5):
+    """ The fixes of gdf kept by `douglas_peucker`. """
+    return gdf[douglas_peucker(gdf.latitude.values, gdf.longitude.values, tolerance)]
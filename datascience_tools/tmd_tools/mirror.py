@@ -0,0 +1,157 @@
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import logging
+import ssl as ssl_
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+CURSOR_FILENAME = '.mirror-cursor'
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_up_to_date(path, entry):
+    return path.is_file() and path.stat().st_size == entry['size'] and sha256(path) == entry['sha256']
+
+
+def make_ssl_context(cert=None, key=None, ca=None):
+    """ SSL context for the server's client-certificate authentication, None if no certificate is given. """
+    if cert is None and ca is None:
+        return None
+    context = ssl_.create_default_context(cafile=ca)
+    if cert is not None:
+        context.load_cert_chain(cert, key)
+    return context
+
+
+async def download(session, url, dest, entry, retries=2):
+    """
+    Downloads one manifest entry into dest, resuming from a previous `.part` file
+    with a Range request, and verifies its sha256.
+
+    Returns 'downloaded', 'superseded' when the file was written again since the entry
+    (a later entry of the manifest lists it), 'missing' when it was deleted from the
+    server, or 'failed'.
+    """
+    import aiohttp
+    path = dest / entry['path']
+    part = path.with_name(path.name + '.part')
+    path.parent.mkdir(exist_ok=True, parents=True)
+    for attempt in range(retries + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        if offset > entry['size']:
+            part.unlink()
+            offset = 0
+        try:
+            if offset < entry['size']:
+                headers = {'Range': f'bytes={offset}-'} if offset else {}
+                async with session.get(f'{url}/files/{entry["path"]}', headers=headers) as response:
+                    if response.status == 404:
+                        logger().warning(f'mirror: {entry["path"]} was deleted from the server, skipped')
+                        return 'missing'
+                    response.raise_for_status()
+                    latest = response.headers.get('X-TMD-SHA256')
+                    if latest is not None and latest != entry['sha256']:
+                        logger().info(f'mirror: {entry["path"]} was written again since this entry, skipped')
+                        if part.exists():
+                            part.unlink()
+                        return 'superseded'
+                    with open(part, 'ab' if response.status == 206 else 'wb') as f:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            f.write(chunk)
+            elif not part.exists():
+                part.touch()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger().warning(f'mirror: transfer of {entry["path"]} interrupted ({type(e).__name__}: {e})')
+            continue
+        if sha256(part) == entry['sha256']:
+            part.replace(path)
+            return 'downloaded'
+        logger().warning(f'mirror: hash mismatch for {entry["path"]}, attempt {attempt+1}/{retries+1}')
+        part.unlink()
+    logger().error(f'mirror: unable to download {entry["path"]}')
+    return 'failed'
+
+
+async def mirror(url, dest, workers=4, ssl=None, dry_run=False, token=None):
+    """
+    Updates the local copy dest of the server's data directory.
+
+    The server only serves its data to the holders of the analyst token,
+    sent as `Authorization: Bearer <token>`.
+
+    Only the files listed in the server's manifest since the last successful run
+    are checked and downloaded, with at most `workers` parallel transfers.
+    The cursor is only advanced once all the files of a manifest page are up to date.
+
+    Returns the list of downloaded paths.
+    """
+    import aiohttp
+    url = url.rstrip('/')
+    dest = Path(dest)
+    dest.mkdir(exist_ok=True, parents=True)
+    cursor_path = dest / CURSOR_FILENAME
+    cursor = int(cursor_path.read_text()) if cursor_path.exists() else 0
+    semaphore = asyncio.Semaphore(workers)
+    downloaded = []
+
+    async def fetch(session, entry):
+        async with semaphore:
+            return await download(session, url, dest, entry)
+
+    connector = aiohttp.TCPConnector(ssl=ssl, limit=workers)
+    headers = {'Authorization': f'Bearer {token}'} if token else None
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        while True:
+            async with session.get(f'{url}/manifest', params={'cursor': cursor}) as response:
+                response.raise_for_status()
+                manifest = json.loads(await response.text())
+            entries = [e for e in manifest['files'] if not is_up_to_date(dest / e['path'], e)]
+            logger().info(f'mirror: {len(manifest["files"])} changed files, {len(entries)} to download')
+            if dry_run:
+                downloaded.extend(e['path'] for e in entries)
+            else:
+                results = await asyncio.gather(*(fetch(session, e) for e in entries))
+                downloaded.extend(e['path'] for (e, r) in zip(entries, results) if r == 'downloaded')
+                if 'failed' in results:
+                    break
+                cursor = manifest['cursor']
+                cursor_path.write_text(str(cursor))
+            if not manifest['more']:
+                break
+            if dry_run:
+                cursor = manifest['cursor']
+    return downloaded
+
+
+if __name__=='__main__':
+    import click
+
+    @click.command()
+    @click.argument('url')
+    @click.argument('output_dir')
+    @click.option('--workers', default=4, help='Number of parallel transfers.')
+    @click.option('--cert', default=None, help='Client certificate (pem).')
+    @click.option('--key', default=None, help='Client certificate key.')
+    @click.option('--ca', default=None, help='Certificate authority of the server (pem).')
+    @click.option('--token', envvar='TMD_ANALYST_TOKEN', default=None, help='Analyst token of the server, defaults to $TMD_ANALYST_TOKEN.')
+    @click.option('--dry-run', is_flag=True, help='Only list the files that would be downloaded.')
+    def main(url, output_dir, workers, cert, key, ca, token, dry_run):
+        logging.basicConfig(level=logging.INFO)
+        ssl = make_ssl_context(cert, key, ca)
+        paths = asyncio.get_event_loop().run_until_complete(mirror(url, output_dir, workers, ssl, dry_run, token))
+        for p in paths:
+            print(p)
+
+    main()
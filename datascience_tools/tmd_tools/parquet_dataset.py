@@ -0,0 +1,181 @@
+from pathlib import Path
+from datetime import timedelta
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+# Hive partitioning: <root>/sensor=<sensor>/mode=<mode>/user=<uid>/date=<yyyy-mm-dd>/<file>.parquet
+# The sensors have different columns: each `sensor=<sensor>` directory is read as its own dataset.
+PARTITIONING = ds.partitioning(pa.schema([
+    ('mode', pa.string()),
+    ('user', pa.string()),
+    ('date', pa.date32()),
+]), flavor='hive')
+
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def partition_path(root, trip_data, uid):
+    return (Path(root)
+        / f'sensor={trip_data.sensor}'
+        / f'mode={trip_data.mode}'
+        / f'user={uid}'
+        / f'date={trip_data.start:%Y-%m-%d}'
+        / f'{trip_data.filepath.stem}.parquet')
+
+
+def write_trip_data(trip_data, path, row_group_size=ROW_GROUP_SIZE, df=None):
+    """
+    Writes one sensor file, or df if given, as a parquet file.
+
+    Rows are sorted by time, so the min/max statistics of each row group
+    allow readers to skip the row groups outside the queried time range.
+    Numeric columns are written as float64, so that all the files of a sensor
+    have the same schema, e.g. when a column only holds integers such as -1.
+    """
+    df = (trip_data.df if df is None else df).drop(columns='norm', errors='ignore')
+    df = df.sort_index().reset_index()
+    df['trip_start'] = pd.Timestamp(trip_data.start)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ms_type = pa.timestamp('ms')
+    table = table.cast(pa.schema([
+        pa.field(f.name, ms_type) if pa.types.is_timestamp(f.type)
+        else pa.field(f.name, pa.float64()) if pa.types.is_integer(f.type) or pa.types.is_floating(f.type)
+        else f
+        for f in table.schema
+    ]))
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp = path.with_suffix('.tmp')
+    pq.write_table(table, tmp, row_group_size=row_group_size, write_statistics=True)
+    tmp.replace(path)
+
+
+def export_parquet(data_dir, output_dir, row_group_size=ROW_GROUP_SIZE, overwrite=False):
+    """
+    Exports the whole data directory as a Hive-partitioned parquet dataset.
+
+    The data recorded inside the users' geofences is dropped, see `geofences.filter_trip`.
+    Files already exported are skipped unless overwrite is True, or the user's
+    geofences were uploaded after they were exported.
+    Yields the exported TripData.
+    """
+    from .geofences import GeoFenceIndex, filter_trip
+
+    def exported(path, geofences_mtime):
+        try:
+            return path.stat().st_mtime >= geofences_mtime
+        except FileNotFoundError:
+            return False
+
+    for user in data_dir.existing_users:
+        index = user.geofences
+        geofences_path = user.path / GeoFenceIndex.filename
+        geofences_mtime = geofences_path.stat().st_mtime if index is not None else 0
+        for trip in user.trips:
+            todo = [d for d in trip.data.values()
+                    if overwrite or not exported(partition_path(output_dir, d, user.uid), geofences_mtime)]
+            if not todo:
+                continue
+            try:
+                dfs = filter_trip(trip, index, sensors=[d.sensor for d in todo]) if index else {}
+            except Exception as e:
+                logger().error(f'export_parquet: unable to load {trip}: {type(e)} - {e}')
+                continue
+            for trip_data in todo:
+                path = partition_path(output_dir, trip_data, user.uid)
+                try:
+                    write_trip_data(trip_data, path, row_group_size, dfs.get(trip_data.sensor))
+                except Exception as e:
+                    logger().error(f'export_parquet: unable to export {trip_data.filepath}: {type(e)} - {e}')
+                    continue
+                yield trip_data
+
+
+def _as_list(value):
+    if value is None or isinstance(value, (list, tuple, set)):
+        return value
+    return [value]
+
+
+def read_parquet(path, sensor=None, mode=None, user=None, start=None, end=None, columns=None):
+    """
+    Reads the parquet dataset written by `export_parquet`.
+
+    Filters on partitions (sensor, mode, user and the date derived from start/end)
+    prune whole directories; the time filter on `ms` skips row groups using their
+    statistics. Only the requested columns are read. When several sensors are read,
+    the columns missing from a sensor are NaN.
+
+    Arguments:
+    path -- root directory of the dataset
+    sensor, mode, user -- a value or a list of values to keep
+    start, end -- anything accepted by pd.Timestamp, bounds are inclusive
+    columns -- list of columns to read, None to read all of them
+
+    Example: all bike accelerometer data in May 2020:
+        read_parquet(path, sensor='accelerometer', mode='bike', start='2020-05-01', end='2020-05-31 23:59:59')
+    """
+    path = Path(path)
+    sensors = _as_list(sensor)
+    if sensors is None:
+        sensors = sorted(p.name[len('sensor='):] for p in path.glob('sensor=*') if p.is_dir())
+
+    filters = []
+    for (name, values) in (('mode', mode), ('user', user)):
+        values = _as_list(values)
+        if values is not None:
+            filters.append(ds.field(name).isin(list(values)))
+    ms_type = pa.timestamp('ms')
+    if start is not None:
+        start = pd.Timestamp(start)
+        # partitions are by start date of the trip: a trip started the day
+        # before may still have data after `start`.
+        filters.append(ds.field('date') >= pa.scalar((start - timedelta(days=1)).date(), type=pa.date32()))
+        filters.append(ds.field('ms') >= pa.scalar(start.to_pydatetime(), type=ms_type))
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters.append(ds.field('date') <= pa.scalar(end.date(), type=pa.date32()))
+        filters.append(ds.field('ms') <= pa.scalar(end.to_pydatetime(), type=ms_type))
+    expr = None
+    for f in filters:
+        expr = f if expr is None else (expr & f)
+
+    dfs = []
+    for s in sensors:
+        sensor_path = path / f'sensor={s}'
+        if not sensor_path.is_dir():
+            continue
+        dataset = ds.dataset(str(sensor_path), format='parquet', partitioning=PARTITIONING)
+        names = dataset.schema.names
+        read = None if columns is None else [c for c in columns if c in names]
+        df = dataset.to_table(columns=read, filter=expr).to_pandas()
+        if columns is None or 'sensor' in columns:
+            df['sensor'] = s
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(dfs, ignore_index=True, sort=False)
+    return df if columns is None else df.reindex(columns=columns)
+
+
+if __name__=='__main__':
+    import click
+    from tqdm.auto import tqdm
+    from .data_directory import DataDirectory
+
+    @click.command()
+    @click.argument('input_dir')
+    @click.argument('output_dir')
+    @click.option('--overwrite', is_flag=True, help='Re-export files already present in output_dir.')
+    def main(input_dir, output_dir, overwrite):
+        data_dir = DataDirectory(Path(input_dir))
+        for trip_data in tqdm(export_parquet(data_dir, output_dir, overwrite=overwrite), miniters=1):
+            pass
+
+    main()
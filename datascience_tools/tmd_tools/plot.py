@@ -1,4 +1,12 @@
-def plot_gps_data(ax, *args, zoom=11, margin=0.1):
+def plot_gps_data(ax, *args, zoom=11, margin=0.1, simplify=None):
+    """
+    Plots a gps track on a map.
+
+    Arguments:
+    ax -- matplotlib axes
+    args -- a dataframe with latitude and longitude columns, or two arrays: latitudes, longitudes
+    simplify -- tolerance in meters, to plot the track simplified with Douglas-Peucker
+    """
     import geotiler
     import numpy as np
     
@@ -7,8 +15,15 @@ def plot_gps_data(ax, *args, zoom=11, margin=0.1):
         latitudes = df['latitude'].values
         longitudes = df['longitude'].values
     else:
-        latitudes = args[0]
-        longitudes = args[1]
+        latitudes = np.asarray(args[0])
+        longitudes = np.asarray(args[1])
+
+    if simplify:
+        from .kinematics import douglas_peucker
+        valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+        latitudes, longitudes = latitudes[valid], longitudes[valid]
+        keep = douglas_peucker(latitudes, longitudes, simplify)
+        latitudes, longitudes = latitudes[keep], longitudes[keep]
 
     extent=[
         longitudes.min(), 
@@ -0,0 +1,106 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from .trip_data import COLUMNS, PROFILE_VERSION
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+# Edges of the histogram of the time between consecutive samples, in milliseconds.
+GAP_EDGES_MS = [0, 10, 20, 50, 100, 200, 500, 1000, 5000, 30000, 60000]
+
+
+def profile_df(df, sensor):
+    """
+    Quality profile of a sensor file, computed in one vectorized pass.
+
+    Arguments:
+    df -- raw content of the file, with a numeric `ms` column, in file order
+    sensor -- 'gps', 'accelerometer' or 'gyroscope'
+    """
+    ms = df['ms'].values.astype(float)
+    ms = ms[np.isfinite(ms)]
+    dt = np.diff(ms)
+    values = df.drop(columns='ms')
+    n = len(df)
+    duration_ms = float(ms.max() - ms.min()) if len(ms) else 0.0
+    counts = np.histogram(dt[dt > 0], bins=GAP_EDGES_MS + [np.inf])[0] if len(dt) else np.zeros(len(GAP_EDGES_MS), int)
+
+    profile = {
+        'version': PROFILE_VERSION,
+        'sensor': sensor,
+        'rows': n,
+        'start_ms': int(ms.min()) if len(ms) else None,
+        'end_ms': int(ms.max()) if len(ms) else None,
+        'duration_s': duration_ms / 1000,
+        'sample_rate_hz': (len(ms) - 1) / (duration_ms / 1000) if duration_ms > 0 else 0.0,
+        'median_gap_ms': float(np.median(dt)) if len(dt) else None,
+        'max_gap_ms': float(dt.max()) if len(dt) else None,
+        'gap_histogram': {'edges_ms': GAP_EDGES_MS, 'counts': counts.tolist()},
+        'duplicates': int((dt == 0).sum()),
+        'out_of_order': int((dt < 0).sum()),
+        'nan_fraction': float(values.isna().values.mean()) if values.size else 0.0,
+        'nan_fraction_per_column': {c: float(values[c].isna().mean()) for c in values.columns} if n else {},
+    }
+    if sensor == 'gps' and n:
+        # the app reports a negative speed when it is not available
+        profile['speed_coverage'] = float((df['speed'] >= 0).mean())
+        profile['position_coverage'] = float((df['latitude'].notna() & df['longitude'].notna()).mean())
+    return profile
+
+
+def read_raw(path, sensor):
+    """ Reads a sensor file as is: no index, no sorting, unparsable values become NaN. """
+    col_names = COLUMNS.get(sensor)
+    usecols = range(len(col_names)) if col_names else None
+    df = pd.read_csv(path, header=None, names=col_names, usecols=usecols)
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+    return df
+
+
+def profile_file(path, sensor):
+    """ Profile of the file at path, the `error` key is set if it could not be read. """
+    try:
+        return profile_df(read_raw(path, sensor), sensor)
+    except Exception as e:
+        return {'version': PROFILE_VERSION, 'sensor': sensor, 'error': f'{type(e).__name__}: {e}'}
+
+
+def write_profile(trip_data, overwrite=False):
+    """
+    Computes the profile of trip_data and stores it in its sidecar file.
+
+    The profile is not recomputed if the sidecar is up to date, see `TripData.profile`.
+    """
+    path = trip_data.profile_path
+    if not overwrite:
+        profile = trip_data.profile
+        if profile is not None:
+            return profile
+    profile = profile_file(trip_data.filepath, trip_data.sensor)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(profile, f)
+    tmp.replace(path)
+    return profile
+
+
+def profile_data_directory(data_dir, workers=None, overwrite=False):
+    """
+    Computes the missing profiles of all the files of data_dir in parallel.
+
+    Yields (trip_data, profile) pairs as they are computed.
+    """
+    files = [d for user in data_dir.existing_users for trip in user.trips for d in trip.data.values()]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        profiles = pool.map(write_profile, files, [overwrite] * len(files), chunksize=16)
+        for (trip_data, profile) in zip(files, profiles):
+            if 'error' in profile:
+                logger().warning(f'profile: unable to read {trip_data.filepath}: {profile["error"]}')
+            yield trip_data, profile
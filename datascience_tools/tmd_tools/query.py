@@ -0,0 +1,186 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+TEST_MODES = ('exploration', 'test')
+
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class TripQuery:
+    """
+    Lazy and chainable query over the trips of a DataDirectory.
+
+    Filters are only evaluated on iteration, using the metadata encoded in
+    the filenames, so no sensor file is opened. Users are filtered before
+    their directory is listed.
+
+    Example:
+        query = TripQuery(data_dir).mode('bike', 'walk').min_duration(minutes=5)
+        for trip, dfs in query.load(prefetch=4):
+            ...
+    """
+    def __init__(self, data_dir, uids=None, physical=True, predicates=()):
+        self.data_dir = data_dir
+        self._uids = uids
+        self._physical = physical
+        self._predicates = tuple(predicates)
+
+    def _copy(self, **kwargs):
+        args = dict(uids=self._uids, physical=self._physical, predicates=self._predicates)
+        args.update(kwargs)
+        return TripQuery(self.data_dir, **args)
+
+    def where(self, predicate):
+        """ Keeps the trips for which predicate(trip) is True. """
+        return self._copy(predicates=self._predicates + (predicate,))
+
+    def users(self, *uids):
+        """ Keeps the users whose uid starts with one of uids. """
+        return self._copy(uids=tuple(uids))
+
+    def all_users(self):
+        """ Includes the users not flagged as physical devices (emulators). """
+        return self._copy(physical=False)
+
+    def mode(self, *modes):
+        modes = set(modes)
+        return self.where(lambda t: t.mode in modes)
+
+    def min_duration(self, duration=None, **kwargs):
+        """ Keeps trips longer than duration, a timedelta or timedelta's keyword arguments. """
+        duration = duration if duration is not None else timedelta(**kwargs)
+        return self.where(lambda t: t.duration > duration)
+
+    def between(self, start=None, end=None):
+        """ Keeps trips overlapping [start, end], bounds are datetimes or iso-formatted strings. """
+        start, end = _to_datetime(start), _to_datetime(end)
+        return self.where(lambda t: (start is None or start <= t.end) and (end is None or t.start <= end))
+
+    def quality(self, min_speed_coverage=None, max_nan_fraction=None, max_gap_seconds=None, rejected=None, sensors=None):
+        """
+        Filters trips on the quality profiles of their files (see `quality.py`), without opening them.
+
+        Trips with an unreadable file are always dropped, files without an up to date
+        profile are kept. Only the files of the given sensors are checked, all of them
+        by default. The dropped trips are logged, and appended with the reason to the
+        list `rejected` if given.
+        """
+        def reason(trip):
+            for data in trip.data.values():
+                if sensors is not None and data.sensor not in sensors:
+                    continue
+                p = data.profile
+                if p is None:
+                    continue
+                if 'error' in p:
+                    return f'unreadable {data.sensor}: {p["error"]}'
+                if max_nan_fraction is not None and p['nan_fraction'] > max_nan_fraction:
+                    return f'{data.sensor} nan fraction {p["nan_fraction"]:.2f}'
+                if max_gap_seconds is not None and (p['max_gap_ms'] or 0) > 1000 * max_gap_seconds:
+                    return f'{data.sensor} gap of {p["max_gap_ms"] / 1000:.0f}s'
+                if min_speed_coverage is not None and p.get('speed_coverage', 1) < min_speed_coverage:
+                    return f'{data.sensor} speed coverage {p["speed_coverage"]:.2f}'
+            return None
+
+        def check(trip):
+            r = reason(trip)
+            if r is None:
+                return True
+            logger().info(f'quality: dropped {trip}: {r}')
+            if rejected is not None:
+                rejected.append((trip, r))
+            return False
+        return self.where(check)
+
+    def _iter_users(self):
+        users = self.data_dir.physical_users if self._physical else self.data_dir.existing_users
+        for user in users:
+            if self._uids is None or any(user.uid.startswith(uid) for uid in self._uids):
+                yield user
+
+    def __iter__(self):
+        for user in self._iter_users():
+            for trip in user.trips:
+                if trip.mode in TEST_MODES or not trip.data:
+                    continue
+                if all(p(trip) for p in self._predicates):
+                    yield trip
+
+    def count(self):
+        return sum(1 for _ in self)
+
+    def load(self, load=None, prefetch=4, workers=2, max_bytes=512 * 2**20):
+        """ Iterates over (trip, data) pairs, see `prefetch_trips`. """
+        return prefetch_trips(self, load=load, prefetch=prefetch, workers=workers, max_bytes=max_bytes)
+
+    def __repr__(self):
+        return f'TripQuery(users={self._uids}, physical={self._physical}, {len(self._predicates)} filters)'
+
+
+def load_trip(trip):
+    """ Loads all the sensor files of trip, returns a dict {sensor: dataframe}. """
+    return {sensor: data.df for (sensor, data) in trip.data.items()}
+
+
+def trip_size(trip):
+    """ Size in bytes of the trip's files, used as an estimate of its memory footprint. """
+    size = 0
+    for data in trip.data.values():
+        try:
+            size += data.filepath.stat().st_size
+        except OSError:
+            pass
+    return size
+
+
+def prefetch_trips(trips, load=None, prefetch=4, workers=2, max_bytes=512 * 2**20):
+    """
+    Iterates over (trip, load(trip)) pairs, loading the next trips on a thread pool.
+
+    Arguments:
+    trips -- an iterable of Trip, for instance a TripQuery
+    load -- function called in the background threads, defaults to `load_trip`
+    prefetch -- maximum number of trips loaded ahead
+    workers -- number of background threads
+    max_bytes -- cap on the size of the files loaded ahead (at least one trip is always loaded)
+    """
+    load = load or load_trip
+    trips = iter(trips)
+    pending = deque()
+    in_flight = 0
+    next_trip = None
+    exhausted = False
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            while not exhausted and len(pending) < prefetch:
+                if next_trip is None:
+                    next_trip = next(trips, None)
+                    if next_trip is None:
+                        exhausted = True
+                        break
+                size = trip_size(next_trip)
+                if pending and in_flight + size > max_bytes:
+                    break
+                pending.append((next_trip, size, pool.submit(load, next_trip)))
+                in_flight += size
+                next_trip = None
+            if not pending:
+                return
+            trip, size, future = pending.popleft()
+            in_flight -= size
+            yield trip, future.result()
+    finally:
+        for (_, _, future) in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
@@ -0,0 +1,220 @@
+from pathlib import Path
+import logging
+import numpy as np
+import pandas as pd
+from .build import BuildManifest
+
+def logger():
+    return logging.getLogger('dataviz')
+
+
+INDEX_FILENAME = 'index.csv'
+SHARD_BYTES = 256 * 2**20
+CHANNELS = ['x', 'y', 'z']
+
+
+def shard_paths(root, shard):
+    return root / f'shard-{shard:05}-xyz.npy', root / f'shard-{shard:05}-ms.npy'
+
+
+def iter_segments(clean_dir):
+    """
+    Yields (path, label, user, trip) for the segments written by `clean_data.write_segments`.
+
+    Users and trips are found in the build manifest of clean_dir; segments
+    missing from the manifest are attributed to an unknown user.
+    """
+    clean_dir = Path(clean_dir)
+    seen = set()
+    for (key, entry) in BuildManifest(clean_dir).entries.items():
+        user, trip = Path(key).parent.name, Path(key).stem
+        for p in entry['outputs']:
+            if p.endswith('.zip'):
+                seen.add(p)
+                yield clean_dir / p, Path(p).parent.name, user, trip
+    for path in sorted((clean_dir / 'data').glob('*/*.zip')):
+        p = str(path.relative_to(clean_dir))
+        if p not in seen:
+            yield path, path.parent.name, 'unknown', path.stem.rsplit('-', 1)[0]
+
+
+class ShardWriter:
+    """
+    Concatenates segments into shards of fixed dtype: float32 (n, 3) for x, y, z
+    and int64 (n,) for the timestamps in ms, saved as .npy files.
+    """
+    def __init__(self, root, shard_bytes=SHARD_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+        for old in self.root.glob('shard-*.npy'):
+            old.unlink()
+        self.shard_bytes = shard_bytes
+        self.shard = 0
+        self.offset = 0
+        self.xyz, self.ms = [], []
+        self.index = []
+
+    def add(self, df, **info):
+        xyz = df[CHANNELS].values.astype(np.float32)
+        ms = df['ms'].values.astype(np.int64)
+        self.index.append(dict(shard=self.shard, offset=self.offset, length=len(df), **info))
+        self.xyz.append(xyz)
+        self.ms.append(ms)
+        self.offset += len(df)
+        if self.offset * (xyz.itemsize * len(CHANNELS) + ms.itemsize) >= self.shard_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.offset:
+            return
+        xyz_path, ms_path = shard_paths(self.root, self.shard)
+        np.save(xyz_path, np.concatenate(self.xyz))
+        np.save(ms_path, np.concatenate(self.ms))
+        self.shard += 1
+        self.offset = 0
+        self.xyz, self.ms = [], []
+
+    def close(self):
+        self.flush()
+        index = pd.DataFrame(self.index, columns=['shard', 'offset', 'length', 'label', 'user', 'trip', 'source'])
+        index.to_csv(self.root / INDEX_FILENAME, index=False)
+        return index
+
+
+def build_dataset(clean_dir, dataset_dir, shard_bytes=SHARD_BYTES, min_length=1):
+    """
+    Writes the segments of clean_dir into shards in dataset_dir, with an index of
+    (shard, offset, length, label, user, trip, source) rows. Yields the segments' paths.
+
+    The segments written by `clean_data` are already without the data recorded
+    inside the users' geofences.
+    """
+    writer = ShardWriter(dataset_dir, shard_bytes)
+    try:
+        for (path, label, user, trip) in iter_segments(clean_dir):
+            try:
+                df = pd.read_csv(path)
+            except Exception as e:
+                logger().error(f'build_dataset: unable to read {path}: {type(e)} - {e}')
+                continue
+            df = df.dropna(subset=CHANNELS)
+            if len(df) >= min_length:
+                writer.add(df, label=label, user=user, trip=trip, source=str(path))
+            yield path
+    finally:
+        writer.close()
+
+
+class ShardedDataset:
+    """
+    Random access to fixed-length windows of the shards written by `build_dataset`.
+
+    Shards are memory-mapped, so dataset[i] is a view on the file and costs no copy
+    nor parsing. Windows never cross segment boundaries.
+
+    Example:
+        dataset = ShardedDataset('dataset', window=512, stride=256)
+        train, validation = dataset.split(validation_fraction=0.2)
+        xyz, label = train[0]
+    """
+    def __init__(self, root, window, stride=None, labels=None, users=None, index=None):
+        """
+        Arguments:
+        root -- directory written by build_dataset
+        window -- number of samples per window
+        stride -- step between two windows of a segment, defaults to window
+        labels, users -- keep only these labels / users
+        """
+        self.root = Path(root)
+        self.window = window
+        self.stride = stride or window
+        if index is None:
+            index = pd.read_csv(self.root / INDEX_FILENAME, dtype={'user': str, 'trip': str, 'label': str})
+        if labels is not None:
+            index = index[index.label.isin(labels)]
+        if users is not None:
+            index = index[index.user.isin(users)]
+        self.index = index.reset_index(drop=True)
+        self.labels = sorted(self.index.label.unique())
+        self._shards = {}
+        self._build_windows()
+
+    def _build_windows(self):
+        lengths = self.index.length.values
+        n = np.where(lengths >= self.window, (lengths - self.window) // self.stride + 1, 0)
+        first = np.repeat(np.cumsum(n) - n, n)
+        self.window_segment = np.repeat(np.arange(len(n)), n)
+        self.window_start = (np.repeat(self.index.offset.values, n)
+                             + self.stride * (np.arange(n.sum()) - first))
+        label_ids = {label: i for (i, label) in enumerate(self.labels)}
+        self.segment_label = np.array([label_ids[l] for l in self.index.label], dtype=np.int64)
+        self.segment_shard = self.index.shard.values
+
+    def shard(self, i):
+        if i not in self._shards:
+            xyz_path, ms_path = shard_paths(self.root, i)
+            self._shards[i] = (np.load(xyz_path, mmap_mode='r'), np.load(ms_path, mmap_mode='r'))
+        return self._shards[i]
+
+    def __len__(self):
+        return len(self.window_start)
+
+    def __getitem__(self, i):
+        """ (xyz, label) of window i, xyz is a read-only (window, 3) float32 view. """
+        segment = self.window_segment[i]
+        start = self.window_start[i]
+        xyz, _ = self.shard(self.segment_shard[segment])
+        return xyz[start:start + self.window], self.segment_label[segment]
+
+    def timestamps(self, i):
+        segment = self.window_segment[i]
+        start = self.window_start[i]
+        _, ms = self.shard(self.segment_shard[segment])
+        return ms[start:start + self.window]
+
+    def batch(self, indices):
+        """ (xyz, labels) arrays of shape (len(indices), window, 3) and (len(indices),). """
+        windows = [self[i] for i in indices]
+        return np.stack([w for (w, _) in windows]), np.array([l for (_, l) in windows])
+
+    def split(self, validation_users=None, validation_fraction=0.2, seed=0):
+        """
+        Splits the dataset by user, so that no user is in both sets.
+
+        Arguments:
+        validation_users -- users of the validation set, drawn at random if None
+        validation_fraction -- fraction of the users drawn for the validation set
+        seed -- seed of the random draw
+        """
+        users = np.array(sorted(self.index.user.unique()))
+        if validation_users is None:
+            rng = np.random.RandomState(seed)
+            n = max(1, int(round(validation_fraction * len(users)))) if len(users) > 1 else 0
+            validation_users = rng.choice(users, size=n, replace=False)
+        validation = self.index.user.isin(set(validation_users))
+        return (self._subset(self.index[~validation]), self._subset(self.index[validation]))
+
+    def _subset(self, index):
+        subset = ShardedDataset(self.root, self.window, self.stride, index=index)
+        subset.labels = self.labels  # keep the same label ids in both sets
+        subset._build_windows()
+        subset._shards = self._shards
+        return subset
+
+    def __repr__(self):
+        return f'ShardedDataset({len(self)} windows of {self.window}, {len(self.index)} segments, labels={self.labels})'
+
+
+if __name__=='__main__':
+    import click
+    from tqdm.auto import tqdm
+
+    @click.command()
+    @click.argument('clean_dir')
+    @click.argument('dataset_dir')
+    @click.option('--shard-mb', default=256, help='Size of the shards, in MB.')
+    def main(clean_dir, dataset_dir, shard_mb):
+        for path in tqdm(build_dataset(clean_dir, dataset_dir, shard_mb * 2**20), miniters=1):
+            pass
+
+    main()
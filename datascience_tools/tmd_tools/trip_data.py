@@ -1,15 +1,51 @@
 from dataclasses import dataclass, field
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
 import logging
-import pandas as pd
 from . import utils
-import numpy as np
 
 def logger():
     return logging.getLogger('dataviz')
 
 
+# Version of the quality profiles, see `quality.py`: older profiles are ignored.
+PROFILE_VERSION = 1
+
+# Columns of the csv files uploaded by the app, per sensor.
+COLUMNS = {
+    'gps': [
+        'ms',
+        'latitude', # Latitude, in degrees
+        'longitude', # Longitude, in degrees
+        'altitude', # In meters above the WGS 84 reference ellipsoid
+        'accuracy', # Estimated horizontal accuracy of this location, radial, in meters
+        'speed', # In meters/second
+        'speedAccuracy', # In meters/second, always 0 on iOS
+        'heading',
+    ],
+    'accelerometer': [
+        'ms',
+        'x',
+        'y',
+        'z',
+    ],
+    'gyroscope': [
+        'ms',
+        'x', 
+        'y',
+        'z',
+    ],
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def from_ms(milliseconds):
+    """ Naive UTC datetime from milliseconds since epoch, as pd.to_datetime(unit='ms') but without pandas. """
+    return EPOCH + timedelta(milliseconds=int(milliseconds))
+
+
 @dataclass
 class TripData:
     start: datetime
@@ -36,42 +72,39 @@ class TripData:
             logger().warning(f'TripData.parse: unable to parse filename: "{filename}"')
             return None
         mode = parts[0]
-        start = pd.to_datetime(int(parts[1]), unit='ms').to_pydatetime()
+        start = from_ms(parts[1])
         sensor = parts[2]
-        end = pd.to_datetime(int(parts[3]), unit='ms').to_pydatetime()
+        end = from_ms(parts[3])
         return TripData(start, end, mode, sensor, filepath)
 
     @property
     def duration(self):
         return self.end - self.start
     
+    @property
+    def profile_path(self):
+        return self.filepath.with_name(self.filepath.name + '.profile.json')
+
+    @property
+    def profile(self):
+        """
+        Data quality profile of the file (see `quality.py`), None if it was not
+        computed or is out of date: older than the file or of another version.
+        """
+        try:
+            if self.profile_path.stat().st_mtime < self.filepath.stat().st_mtime:
+                return None
+            with open(self.profile_path) as f:
+                profile = json.load(f)
+        except FileNotFoundError:
+            return None
+        return profile if profile.get('version') == PROFILE_VERSION else None
+
     @property 
     def df(self):
-        names = {
-            'gps': [
-                'ms',
-                'latitude', # Latitude, in degrees
-                'longitude', # Longitude, in degrees
-                'altitude', # In meters above the WGS 84 reference ellipsoid
-                'accuracy', # Estimated horizontal accuracy of this location, radial, in meters
-                'speed', # In meters/second
-                'speedAccuracy', # In meters/second, always 0 on iOS
-                'heading',
-            ],
-            'accelerometer': [
-                'ms',
-                'x',
-                'y',
-                'z',
-            ],
-            'gyroscope': [
-                'ms',
-                'x', 
-                'y',
-                'z',
-            ],
-        }
-        col_names = names.get(self.sensor)
+        import numpy as np
+        import pandas as pd
+        col_names = COLUMNS.get(self.sensor)
         usecols = range(len(col_names)) if col_names else None
         df = pd.read_csv(self.filepath, names=col_names, usecols=usecols, index_col=0)
         df.index = pd.to_datetime(df.index, unit='ms')
@@ -3,8 +3,6 @@ import datetime
 import logging
 from . import trip_data as td
 from . import trip as T
-import shutil
-import numpy as np
 
 def logger():
     return logging.getLogger('dataviz')
@@ -23,7 +21,7 @@ class UserDirectory:
     @property
     def trips(self):
         try:
-            paths = list(self.path.iterdir())
+            paths = [p for p in self.path.iterdir() if p.suffix == '.csv']
             trips_data = [td.TripData.parse(path) for path in paths]
             trips_data = [t for t in trips_data if t is not None]
             key = lambda t: (t.start, t.end, t.mode)
@@ -40,6 +38,15 @@ class UserDirectory:
         test_modes = set(('exploration', 'test'))
         return [t for t in self.trips if t.mode not in test_modes and t.data]
 
+    @property
+    def geofences(self):
+        """ The user's private geofences, as a GeoFenceIndex, or None if none were uploaded. """
+        from . import geofences as gf
+        path = self.path / gf.GeoFenceIndex.filename
+        if not path.exists():
+            return None
+        return gf.GeoFenceIndex.load(path)
+
     @property
     def durations(self):
         d = {}
@@ -1,9 +1,8 @@
 from string import Template
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 
 
 def plot_timeseries(df):
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(nrows=4, ncols=1, figsize=(15, 5), sharex=True)
     colors=["#7aa0c4","#ca82e1" ,"#8bcd50","#e18882"]
     for i, c in enumerate(df.columns):
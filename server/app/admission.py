@@ -0,0 +1,150 @@
+from dataclasses import dataclass, asdict
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import shutil
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+@dataclass
+class AdmissionConfig:
+    max_uploads: int = env_int('TMD_MAX_UPLOADS', 16)                     # uploads processed at the same time
+    max_uploads_per_uid: int = env_int('TMD_MAX_UPLOADS_PER_UID', 2)      # processed or queued, per uid
+    max_queued: int = env_int('TMD_MAX_QUEUED_UPLOADS', 64)               # uploads waiting for a slot
+    queue_timeout: float = float(os.environ.get('TMD_UPLOAD_QUEUE_TIMEOUT', 30))  # seconds, before a queued upload is rejected
+    min_free_bytes: int = env_int('TMD_MIN_FREE_DISK_MB', 1024) * 2**20   # free space to keep on the data volume
+    retry_after: int = env_int('TMD_RETRY_AFTER', 60)                     # seconds, hint sent with rejections
+
+
+class Rejected(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the number of uploads processed at the same time.
+
+    Uploads over the global limit wait in a bounded queue. An upload is rejected
+    with 429 when its uid already has too many uploads in progress, and with 503
+    when the queue is full, the wait is too long or the disk is almost full.
+
+    The state is per process: with several workers, the limits apply to each worker.
+    """
+    def __init__(self, data_dir, config=None, blocked=None):
+        """
+        Arguments:
+        data_dir -- data directory whose free space is checked, or a function
+                    returning the data directories of a key (a path or a list of paths)
+        blocked -- function returning True for the keys whose uploads are refused for now
+        """
+        self.data_dir = data_dir
+        self.blocked = blocked
+        self.config = config or AdmissionConfig()
+        self.active = 0
+        self.queued = 0
+        self.per_uid = {}
+        self.rejected = {}
+        self._condition = None
+        self._loop = None
+
+    @property
+    def _slots(self):
+        # created lazily, to be bound to the server's event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+            self._loop = asyncio.get_event_loop()
+        return self._condition
+
+    async def _wake_all(self):
+        async with self._slots:
+            self._slots.notify_all()
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'uids': len(self.per_uid),
+            'rejected': dict(self.rejected),
+        }
+
+    def update(self, **values):
+        for (key, value) in values.items():
+            if not hasattr(self.config, key):
+                raise KeyError(key)
+            setattr(self.config, key, type(getattr(self.config, key))(value))
+        logging.info(f'Admission config updated: {asdict(self.config)}')
+        if self._loop is not None:
+            # queued uploads may be admitted with the new limits, update may run outside of the loop
+            asyncio.run_coroutine_threadsafe(self._wake_all(), self._loop)
+
+    def _reject(self, status_code, reason, retry_after, key):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        logging.warning(f'Upload rejected ({reason}) for `{key}`: {self.stats()}')
+        return Rejected(status_code, reason, retry_after)
+
+    def _free_bytes(self, key):
+        paths = self.data_dir(key) if callable(self.data_dir) else self.data_dir
+        free = []
+        for path in (paths if isinstance(paths, list) else [paths]):
+            while not path.exists():
+                path = path.parent
+            free.append(shutil.disk_usage(path).free)
+        return min(free)
+
+    def _release_uid(self, key):
+        self.per_uid[key] -= 1
+        if not self.per_uid[key]:
+            del self.per_uid[key]
+
+    @asynccontextmanager
+    async def admit(self, key, content_length=0):
+        """
+        Waits for an upload slot, raises Rejected if the upload should be retried later.
+
+        Arguments:
+        key -- the uid of the sender, or its address
+        content_length -- announced size of the upload, in bytes
+        """
+        config = self.config
+        if self.blocked is not None and self.blocked(key):
+            raise self._reject(503, 'uid being moved', config.retry_after, key)
+        if self.per_uid.get(key, 0) >= config.max_uploads_per_uid:
+            raise self._reject(429, 'too many uploads for uid', config.retry_after, key)
+        if self._free_bytes(key) - content_length < config.min_free_bytes:
+            raise self._reject(503, 'not enough disk space', 10 * config.retry_after, key)
+
+        self.per_uid[key] = self.per_uid.get(key, 0) + 1
+        try:
+            if self.active >= config.max_uploads:
+                if self.queued >= config.max_queued:
+                    raise self._reject(503, 'upload queue full', config.retry_after, key)
+                self.queued += 1
+                try:
+                    async with self._slots:
+                        await asyncio.wait_for(
+                            self._slots.wait_for(lambda: self.active < self.config.max_uploads),
+                            timeout=config.queue_timeout)
+                        self.active += 1
+                except asyncio.TimeoutError:
+                    raise self._reject(503, 'upload queue timeout', config.retry_after, key)
+                finally:
+                    self.queued -= 1
+            else:
+                self.active += 1
+
+            try:
+                yield
+            finally:
+                self.active -= 1
+                async with self._slots:
+                    self._slots.notify()
+        finally:
+            self._release_uid(key)
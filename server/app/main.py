@@ -1,19 +1,101 @@
-from fastapi import FastAPI, Form, File, UploadFile, HTTPException, Body
+from fastapi import FastAPI, Form, File, UploadFile, HTTPException, Body, Header, Request, Depends
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List
 
+from contextlib import contextmanager
 import datetime
+import fcntl
+import hashlib
+import hmac
 import logging
-import shutil
+import os
 import json
+import threading
 from pathlib import Path
 
 import security
+import admission
+from placement import Placement
 
 
 app = FastAPI()
 
 
+def requireToken(variable, detail):
+    """
+    Dependency checking the `Authorization: Bearer <token>` header against the token
+    of the environment variable `variable`. Endpoints are disabled when it is not set.
+    """
+    token = os.environ.get(variable)
+
+    def check(authorization: str = Header(None)):
+        if not token:
+            raise HTTPException(status_code=404, detail="Not Found")
+        if not hmac.compare_digest((authorization or '').encode(), f'Bearer {token}'.encode()):
+            raise HTTPException(status_code=401, detail=detail, headers={'WWW-Authenticate': 'Bearer'})
+    return check
+
+
+# The mirror endpoints serve the data of all the users: the client certificate,
+# shipped in every build of the app, is not enough to access them.
+requireAnalyst = requireToken('TMD_ANALYST_TOKEN', "Invalid analyst token")
+requireAdmin = requireToken('TMD_ADMIN_TOKEN', "Invalid admin token")
+
+
+@app.on_event("startup")
+def buildJournal():
+    """ Builds the journal of changes once, from the existing files, before serving requests. """
+    with journalLock():
+        if not JOURNAL_FILEPATH.exists():
+            rebuildJournal()
+
+
+@app.middleware("http")
+async def admissionControl(request: Request, call_next):
+    """
+    Admission control for `/upload`, applied before the body is received.
+    The app sends its uid in the `X-TMD-UID` header, the client address is used otherwise.
+    """
+    if request.url.path != '/upload':
+        return await call_next(request)
+
+    key = request.headers.get('x-tmd-uid') or request.headers.get('x-forwarded-for', '').split(',')[0].strip()
+    key = key or (request.client.host if request.client else 'unknown')
+    try:
+        content_length = int(request.headers.get('content-length', 0))
+    except ValueError:
+        content_length = 0
+
+    try:
+        async with uploads.admit(key, content_length):
+            return await call_next(request)
+    except admission.Rejected as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={'detail': e.detail},
+            headers={'Retry-After': str(e.retry_after)})
+
+
+@app.get("/admission")
+def admissionStatus():
+    return {
+        'config': admission.asdict(uploads.config),
+        'stats': uploads.stats(),
+    }
+
+
+@app.put("/admission", dependencies=[Depends(requireAdmin)])
+def admissionUpdate(config: dict = Body(...)):
+    """ Updates the admission limits at runtime, for instance `{"max_uploads": 8}`. """
+    try:
+        uploads.update(**config)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f'Invalid admission parameter: {e}')
+    return admissionStatus()
+
+
 @app.get("/hello")
 def hello():
     return "Server v1. Hello."
@@ -27,6 +109,7 @@ def register(uid: str = Form(...), info: str = Form(...)):
     infoData = json.loads(info)
     infoData['app_name'] = uid
     uids[candidate] = infoData
+    placement.assign(candidate)
     dumpUIDs(uids)   
     logging.info(f'New registration: {candidate}: {uid}')
     return {'uid':candidate} 
@@ -47,9 +130,10 @@ async def upload(
         logging.warning(f'Unknown UID: `{uid}`')
         raise HTTPException(status_code=401, detail="Unknown UID")
 
+    refuseIfMoving(uid)
     fpath = filepath(uid, mode, start, end, data.filename)
     logging.info(f'Receiving data: {fpath}')
-    writeToDisk(data.file, fpath)
+    await run_in_threadpool(writeToDisk, data.file, fpath)
 
     return {
         "mode": mode,
@@ -121,17 +205,92 @@ async def geofencesUpload(
         'radiusInMeters': obj.radiusInMeters
     } for obj in data]
 
+    refuseIfMoving(uid)
     fpath = fencesPath(uid)
     logging.info(f'Receiving data: {fpath}')
-    Path(fpath).parent.mkdir(exist_ok=True)
+    Path(fpath).parent.mkdir(exist_ok=True, parents=True)
     with Path(fpath).open('w') as f:
         json.dump(data, f)
+    recordFile(fpath)
 
     return {
         "status": "ok",
     }
 
 
+@app.get("/manifest", dependencies=[Depends(requireAnalyst)])
+def manifest(cursor: int = 0, limit: int = 10000):
+    """
+    Files written since `cursor`, an offset in the journal of changes.
+    
+    Each file is listed once with its latest size and sha256. Clients pass the
+    returned cursor to the next call, and call again while `more` is true.
+    A cursor which is not at the start of a line of the journal (e.g. after the
+    journal was rebuilt) is reset to 0, and all the files are listed again.
+    """
+    files = {}
+    if not JOURNAL_FILEPATH.exists():
+        return {'cursor': 0, 'more': False, 'files': []}
+    with JOURNAL_FILEPATH.open('rb') as f:
+        if not isLineStart(f, cursor):
+            logging.warning(f'Invalid journal cursor {cursor}, listing all the files')
+            cursor = 0
+        f.seek(cursor)
+        more = True
+        for _ in range(limit):
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                more = False  # end of journal, or line being written
+                break
+            cursor += len(line)
+            entry = json.loads(line)
+            files[entry['path']] = entry
+    return {
+        'cursor': cursor,
+        'more': more,
+        'files': list(files.values()),
+    }
+
+
+@app.get("/files/{path:path}", dependencies=[Depends(requireAnalyst)])
+def download(path: str, range_header: str = Header(None, alias='Range')):
+    """
+    Content of a file of the data directory, supports `Range: bytes=<start>-` to resume transfers.
+    The sha256 of its latest entry in the journal is sent in the `X-TMD-SHA256` header.
+    """
+    parts = Path(path).parts
+    root = placement.root(parts[0]) if len(parts) > 1 else DATA_DIR
+    fpath = (root / path).resolve()
+    if root.resolve() not in fpath.parents or not fpath.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    size = fpath.stat().st_size
+    entry = latestEntry(Path(path).as_posix())
+    start = 0
+    if range_header:
+        try:
+            unit, spec = range_header.split('=')
+            start = int(spec.split('-')[0])
+            assert unit.strip() == 'bytes' and 0 <= start < max(size, 1)
+        except Exception:
+            raise HTTPException(status_code=416, detail="Invalid range")
+
+    def content():
+        with fpath.open('rb') as f:
+            f.seek(start)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(size - start)}
+    if entry is not None:
+        # lets clients recognize the manifest entries superseded by a later write
+        headers['X-TMD-SHA256'] = entry['sha256']
+    if range_header:
+        headers['Content-Range'] = f'bytes {start}-{size-1}/{size}'
+        return StreamingResponse(content(), status_code=206, headers=headers, media_type='application/octet-stream')
+    return StreamingResponse(content(), headers=headers, media_type='application/octet-stream')
+
+
 #-------------------------------------------------------------------
 
 
@@ -139,7 +298,19 @@ def format(milliseconds):
     datetime.datetime.fromtimestamp(float(milliseconds)/1000).strftime('%Y-%m-%d %H:%M:%S.%f')
 
 
-UID_FILEPATH = Path('/app/data/uids.json')
+DATA_DIR = Path(os.environ.get('TMD_DATA_DIR', '/app/data'))
+# Users' directories are spread over these roots, e.g. TMD_DATA_ROOTS=/app/data:/mnt/disk2/data
+DATA_ROOTS = [Path(p) for p in os.environ.get('TMD_DATA_ROOTS', str(DATA_DIR)).split(':') if p]
+UID_FILEPATH = DATA_DIR / 'uids.json'
+JOURNAL_FILEPATH = DATA_DIR / 'changes.log'
+JOURNAL_LOCKPATH = DATA_DIR / 'changes.lock'
+CHUNK_SIZE = 1024 * 1024
+
+placement = Placement(DATA_DIR, DATA_ROOTS)
+# the disk of an unknown key (e.g. an address) is not known: all the roots are checked
+uploads = admission.AdmissionController(
+    lambda key: placement.root(key) if placement.known(key) else placement.roots,
+    blocked=placement.is_moving)
 
 
 def load_uids():
@@ -151,7 +322,9 @@ def load_uids():
 
 def dumpUIDs(uids):
     UID_FILEPATH.parent.mkdir(exist_ok=True, parents=True)
-    json.dump(uids, UID_FILEPATH.open('w'))
+    with UID_FILEPATH.open('w') as f:
+        json.dump(uids, f)
+    recordFile(UID_FILEPATH)
 
 
 def find_new_candidate(token, uids):
@@ -168,7 +341,14 @@ def find_new_candidate(token, uids):
 
 
 def data_dir_path(uid):
-    return f"/app/data/{uid}"
+    return f"{placement.user_dir(uid)}"
+
+
+def refuseIfMoving(uid):
+    """ The directory of uid is being moved to another root (see rebalance.py): the app retries later. """
+    if placement.is_moving(uid):
+        logging.warning(f'Write refused while `{uid}` is moved')
+        raise HTTPException(status_code=503, detail="uid being moved", headers={'Retry-After': str(uploads.config.retry_after)})
 
 
 def filename(mode, start, end, tag):
@@ -185,5 +365,100 @@ def fencesPath(uid):
 
 
 def writeToDisk(data: UploadFile, dest: str):
-    Path(dest).parent.mkdir(exist_ok=True)
-    shutil.copyfileobj(data, open(dest, 'wb'))
+    Path(dest).parent.mkdir(exist_ok=True, parents=True)
+    h = hashlib.sha256()
+    size = 0
+    with open(dest, 'wb') as f:
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    recordChange(dest, size, h.hexdigest())
+
+
+def hashFile(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def journalEntry(path, size, sha256):
+    relpath = placement.relative(path).as_posix()
+    return json.dumps({'path': relpath, 'size': size, 'sha256': sha256}) + '\n'
+
+
+@contextmanager
+def journalLock():
+    """ Lock of the journal, shared by the worker processes. """
+    DATA_DIR.mkdir(exist_ok=True, parents=True)
+    with JOURNAL_LOCKPATH.open('a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def isLineStart(f, cursor):
+    """ True if cursor is the offset of a line of the open journal f, or its end. """
+    if cursor == 0:
+        return True
+    if cursor < 0 or cursor > os.fstat(f.fileno()).st_size:
+        return False
+    f.seek(cursor - 1)
+    return f.read(1) == b'\n'
+
+
+def recordChange(path, size, sha256):
+    """ Appends a written file to the journal of changes served by `/manifest`. """
+    entry = journalEntry(path, size, sha256)
+    with journalLock():
+        with JOURNAL_FILEPATH.open('a') as f:
+            f.write(entry)
+
+
+def recordFile(path):
+    recordChange(path, Path(path).stat().st_size, hashFile(path))
+
+
+journalIndex = {'offset': 0, 'entries': {}}
+journalIndexLock = threading.Lock()
+
+
+def latestEntry(relpath):
+    """ Latest journal entry of a file, None if it was never recorded. Reads the new entries of the journal. """
+    with journalIndexLock:
+        try:
+            with JOURNAL_FILEPATH.open('rb') as f:
+                if os.fstat(f.fileno()).st_size < journalIndex['offset']:
+                    journalIndex.update(offset=0, entries={})  # journal rebuilt
+                f.seek(journalIndex['offset'])
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    journalIndex['offset'] += len(line)
+                    entry = json.loads(line)
+                    journalIndex['entries'][entry['path']] = entry
+        except FileNotFoundError:
+            pass
+        return journalIndex['entries'].get(relpath)
+
+
+def rebuildJournal():
+    """
+    Builds the journal of changes from the files already in the data directory.
+    Called with the journal lock held, see `buildJournal`.
+    """
+    logging.info(f'Rebuilding journal of changes: {JOURNAL_FILEPATH}')
+    DATA_DIR.mkdir(exist_ok=True, parents=True)
+    tmp = JOURNAL_FILEPATH.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        if UID_FILEPATH.exists():
+            f.write(journalEntry(UID_FILEPATH, UID_FILEPATH.stat().st_size, hashFile(UID_FILEPATH)))
+        for root in dict.fromkeys(DATA_ROOTS + [DATA_DIR]):
+            for path in sorted(root.glob('*/*')):
+                if path.is_file():
+                    f.write(journalEntry(path, path.stat().st_size, hashFile(path)))
+    tmp.replace(JOURNAL_FILEPATH)
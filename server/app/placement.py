@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from pathlib import Path
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import shutil
+import time
+
+
+def is_plain(name):
+    """ True if name is a file name, without directories. """
+    return Path(name).name == name and name != '..'
+
+
+def stable_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class Placement:
+    """
+    Places the users' directories on several data roots (disks), by consistent hashing of the uid.
+
+    The root of each registered user is recorded in `placement.json`, in the primary
+    root, so adding a root only changes where new users go; `rebalance.py` moves the
+    existing users to their new root. Users stored before the placement map existed
+    are found in the primary root.
+    """
+    filename = 'placement.json'
+
+    def __init__(self, primary, roots=None, vnodes=64):
+        """
+        Arguments:
+        primary -- data root holding uids.json and the placement map
+        roots -- list of data roots, defaults to [primary]
+        vnodes -- number of points of each root on the hash ring
+        """
+        self.primary = Path(primary)
+        self.roots = [Path(r) for r in roots] if roots else [self.primary]
+        self.path = self.primary / Placement.filename
+        for root in self.roots:
+            root.mkdir(exist_ok=True, parents=True)
+        ring = sorted((stable_hash(f'{root}#{i}'), str(root)) for root in self.roots for i in range(vnodes))
+        self._ring_keys = [h for (h, _) in ring]
+        self._ring_roots = [r for (_, r) in ring]
+        self._mtime = None
+        self.users = {}
+        self._reload()
+
+    def _reload(self):
+        # the map is shared by all the workers, reload it when another one changed it
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with self.path.open() as f:
+                self.users = json.load(f)
+            self._mtime = mtime
+
+    @contextmanager
+    def lock(self):
+        """ Lock of the map, shared by the server's workers and rebalance.py, held while changing it. """
+        self.primary.mkdir(exist_ok=True, parents=True)
+        with (self.primary / 'placement.lock').open('a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._reload()
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self):
+        self.primary.mkdir(exist_ok=True, parents=True)
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self.users, f)
+        tmp.replace(self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+
+    def ring_root(self, uid):
+        """ Root of uid on the hash ring, regardless of where its data currently is. """
+        i = bisect.bisect(self._ring_keys, stable_hash(uid)) % len(self._ring_keys)
+        return Path(self._ring_roots[i])
+
+    def root(self, uid):
+        self._reload()
+        if uid in self.users:
+            return Path(self.users[uid])
+        if (self.primary / uid).is_dir():
+            return self.primary
+        return self.ring_root(uid)
+
+    def known(self, uid):
+        """ True if uid has a directory or a recorded root, i.e. is not only a key such as an address. """
+        self._reload()
+        return uid in self.users or (is_plain(uid) and (self.primary / uid).is_dir())
+
+    def moving_path(self, uid):
+        return self.primary / f'{uid}.moving'
+
+    def is_moving(self, uid):
+        """ True while the directory of uid is being moved: nothing must be written in it. """
+        return is_plain(uid) and self.moving_path(uid).exists()
+
+    def user_dir(self, uid):
+        return self.root(uid) / uid
+
+    def assign(self, uid):
+        """ Records the root of a new user. """
+        with self.lock():
+            self.users[uid] = str(self.root(uid))
+            self.save()
+
+    def relative(self, path):
+        """ Path relative to the data root containing it, i.e. `<uid>/<file>` for the users' files. """
+        path = Path(path)
+        for root in sorted(set(self.roots + [self.primary]), key=lambda r: -len(r.parts)):
+            if root in path.parents:
+                return path.relative_to(root)
+        raise ValueError(f'{path} is not in a data root')
+
+    def plan(self, uids):
+        """ (uid, current root, target root) of the users not on their ring root. """
+        moves = []
+        for uid in uids:
+            current, target = self.root(uid), self.ring_root(uid)
+            if current != target and (current / uid).is_dir():
+                moves.append((uid, current, target))
+        return moves
+
+    def move(self, uid, target, grace=10, attempts=3):
+        """
+        Moves the directory of uid to the root target.
+
+        Writes for uid are refused (see `is_moving`) during the move, after a grace
+        period of `grace` seconds for those already in progress. Files are copied and
+        checked by sha256 and unchanged since the copy, then the map is updated and the
+        old directory is deleted. Nothing is changed if the copy cannot be verified.
+        """
+        src = self.user_dir(uid)
+        dst = Path(target) / uid
+        logging.info(f'Moving {src} to {dst}')
+
+        def copy_missing():
+            dst.mkdir(exist_ok=True, parents=True)
+            for f in src.iterdir():
+                d = dst / f.name
+                if f.is_file() and not same_stat(f, d):
+                    shutil.copy2(f, d)
+
+        def different():
+            return [f.name for f in src.iterdir() if f.is_file() and not same_content(f, dst / f.name)]
+
+        def changed():
+            # e.g. a write which started before the marker and outlasted the grace period
+            return [f.name for f in src.iterdir() if f.is_file() and not same_stat(f, dst / f.name)]
+
+        marker = self.moving_path(uid)
+        marker.touch()
+        try:
+            time.sleep(grace)
+            for _ in range(attempts):
+                copy_missing()
+                if not different() and not changed():
+                    break
+            else:
+                logging.error(f'Unable to move {src}, files differ: {different() or changed()}')
+                return False
+            with self.lock():
+                self.users[uid] = str(target)
+                self.save()
+            shutil.rmtree(src)
+            return True
+        finally:
+            marker.unlink()
+
+
+def same_stat(a, b):
+    if not b.exists():
+        return False
+    a, b = a.stat(), b.stat()
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def same_content(a, b):
+    return b.is_file() and a.stat().st_size == b.stat().st_size and file_sha256(a) == file_sha256(b)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Moves the users' directories to their root on the hash ring, after data roots were added.
+
+The data roots are read from the environment, as by the server (see readme.md).
+Usage::
+    ./rebalance.py [--dry-run] [--grace SECONDS]
+"""
+import argparse
+import logging
+
+import main
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true', help='Only print the moves.')
+    parser.add_argument('--grace', type=float, default=10, help='Seconds left to the writes in progress before moving a user.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    moves = main.placement.plan(main.load_uids().keys())
+    for (uid, current, target) in moves:
+        print(f'{uid}: {current} -> {target}')
+    print(f'{len(moves)} users to move')
+
+    if not args.dry_run:
+        failed = [uid for (uid, current, target) in moves if not main.placement.move(uid, target, args.grace)]
+        print(f'{len(moves) - len(failed)} users moved, {len(failed)} failed: {failed}')
@@ -327,6 +327,8 @@ class Uploader {
       await _uploadUrl,
       data: formData,
       cancelToken: token,
+      // Lets the server apply its per-uid admission control before reading the body.
+      options: Options(headers: {'X-TMD-UID': uid}),
     ).catchError((e) {
       if (e is DioError) {
         switch (e.type) {